@@ -0,0 +1,109 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Compares dotsi.fy(.) with records.PageRecord, for wrapping page stubs
+# as listings do (see `pageModel.getPageStubs(.)`). No DB is needed.
+# Usage:
+#   python benchmarks/pageRecords.py [stubCount]
+# For each wrapper, reports the time to wrap `stubCount` stubs (best of
+# 5), the memory retained by the wrapped stubs, and the time for a
+# typical theme's field reads (`page.meta.slug`, etc.) across them.
+
+import sys;
+import os;
+import time;
+import json;
+import tracemalloc;
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))));
+
+import dotsi;
+from vilolog import markup;
+from vilolog import records;
+
+ROUND_COUNT = 5;
+
+def buildStubJson ():
+    "Returns a JSON string, like a stub (body-less page) row from Postgres.";
+    body = (
+        "# Intro\n\nSome *text*, with `code`. " * 20 +
+        "\n## Section A\n\ntext\n## Section B\n\nmore ![i](/x.png)\n"
+    );
+    return json.dumps({
+        "_id": "a" * 32, "blogId": "", "version": 1, "type": "page",
+        "authorId": "b" * 32, "createdAt": 1600000000,
+        "meta": {
+            "title": "Some Title", "slug": "some-title",
+            "isoDate": "2020-10-01", "template": "page.html",
+            "isDraft": False, "tags": ["python", "web-dev"],
+        },
+        "derived": markup.computeDerived(body),
+    });
+
+def readFields (stubList):
+    "Reads fields like `home.html` does.";
+    for page in stubList:
+        page.meta.slug, page.meta.title, page.meta.get("isoDate");
+        derived = page.get("derived") or {};
+        derived.get("readingMins"), derived.get("excerpt");
+
+def measure (wrap, stubJson, stubCount):
+    "Returns (wrapSecs, retainedBytes, readSecs) for `wrap`.";
+    wrapSecs = float("inf");
+    for _ in range(ROUND_COUNT):
+        docList = [json.loads(stubJson) for _ in range(stubCount)];
+        startTime = time.perf_counter();
+        stubList = [wrap(doc) for doc in docList];
+        wrapSecs = min(wrapSecs, time.perf_counter() - startTime);
+    # Memory, measured separately, as tracemalloc slows allocation:
+    docList = [json.loads(stubJson) for _ in range(stubCount)];
+    tracemalloc.start();
+    stubList = [wrap(doc) for doc in docList];
+    retainedBytes = tracemalloc.get_traced_memory()[0];
+    tracemalloc.stop();
+    readSecs = float("inf");
+    for _ in range(ROUND_COUNT):
+        startTime = time.perf_counter();
+        readFields(stubList);
+        readSecs = min(readSecs, time.perf_counter() - startTime);
+    return wrapSecs, retainedBytes, readSecs;
+
+def main (stubCount=5000):
+    stubCount = int(stubCount);
+    stubJson = buildStubJson();
+    print("Wrapping %d stubs (best of %d):" % (stubCount, ROUND_COUNT));
+    for (name, wrap) in [
+        ("dotsi.fy", dotsi.fy), ("PageRecord", records.PageRecord),
+    ]:
+        wrapSecs, retainedBytes, readSecs = measure(wrap, stubJson, stubCount);
+        print("  %-10s  wrap %7.1f ms   retained %6.2f MB   reads %6.1f ms" % (
+            name, wrapSecs * 1000, retainedBytes / 1e6, readSecs * 1000,
+        ));
+
+if __name__ == "__main__":
+    main(*sys.argv[1:]);
+
+# End ######################################################
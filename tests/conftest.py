@@ -0,0 +1,56 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Tests that need Postgres use the `pgUrl` fixture, and are skipped unless
+# VILOLOG_TEST_PG_URL is set. ALL TABLES in that database are dropped!
+
+import os;
+
+import psycopg2;
+import pytest;
+
+@pytest.fixture
+def pgUrl ():
+    "Returns VILOLOG_TEST_PG_URL, after emptying that database.";
+    pgUrl = os.environ.get("VILOLOG_TEST_PG_URL");
+    if not pgUrl:
+        pytest.skip("VILOLOG_TEST_PG_URL isn't set.");
+    conn = psycopg2.connect(pgUrl);
+    conn.autocommit = True;
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT tablename FROM pg_tables WHERE schemaname = 'public';"
+        );
+        for (tableName,) in cur.fetchall():
+            cur.execute('DROP TABLE IF EXISTS "%s" CASCADE;' % tableName);
+    conn.close();
+    return pgUrl;
+
+@pytest.fixture
+def noRetryDelay (monkeypatch):
+    "Makes failed jobs due for retry immediately.";
+    from vilolog import jobModel;
+    monkeypatch.setattr(jobModel, "JOB_RETRY_BASE_SECS", 0);
@@ -0,0 +1,137 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Cache headers and purges, against a local stand-in for the proxy.
+
+import threading;
+import http.server;
+
+import pytest;
+
+import vilolog;
+from testkit import Client, holdJobWorkers, setupAdmin;
+from testkit import mkMeta, newPage, editPage, deletePage;
+
+class StandInProxy:
+    "Records PURGE requests. Fails the next `failCount` of them, w/ 503.";
+
+    def __init__ (self):
+        self.purgeList = [];
+        self.failCount = 0;
+        proxy = self;
+        class Handler (http.server.BaseHTTPRequestHandler):
+            def do_PURGE (self):
+                if proxy.failCount:
+                    proxy.failCount -= 1;
+                    self.send_response(503);
+                else:
+                    keys = self.headers.get("Surrogate-Key");
+                    proxy.purgeList.append(set(keys.split()));
+                    self.send_response(200);
+                self.end_headers();
+            def log_message (self, *args):
+                pass;
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), Handler,
+        );
+        self.url = "http://127.0.0.1:%s/" % self.server.server_port;
+        threading.Thread(target=self.server.serve_forever, daemon=True).start();
+
+    def close (self):
+        self.server.shutdown();
+        self.server.server_close();
+
+@pytest.fixture
+def proxy ():
+    proxy = StandInProxy();
+    yield proxy;
+    proxy.close();
+
+def buildApp (pgUrl, proxy, cacheMaxAge):
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, cacheMaxAge=cacheMaxAge,
+        purgeHook=vilolog.mkHttpPurgeHook(proxy.url), jobWorkerCount=1,
+    );
+    return holdJobWorkers(app);
+
+def test_surrogateKeys (pgUrl, proxy):
+    app = buildApp(pgUrl, proxy, cacheMaxAge=60);
+    admin = setupAdmin(app);
+    idA = newPage(admin, mkMeta("aa", isoDate="2020-10-01"));
+    idB = newPage(admin, mkMeta("bb", isoDate="2020-10-02"));
+    app.runDueJobs();
+    assert proxy.purgeList == [
+        {"pages-default", "page-" + idA},
+        {"pages-default", "page-" + idB, "page-" + idA},
+    ];
+    anon = Client(app.wsgi);
+    resp = anon.req("GET", "/aa");
+    assert resp["headers"]["CACHE-CONTROL"].startswith("public, max-age=60");
+    assert set(resp["headers"]["SURROGATE-KEY"].split()) == {
+        "blog-default", "page-" + idA, "page-" + idB,
+    };
+    resp = anon.req("GET", "/");
+    assert set(resp["headers"]["SURROGATE-KEY"].split()) == {
+        "blog-default", "pages-default",
+    };
+    # Editing `aa` purges it and its (new) neighbour, `bb`:
+    del proxy.purgeList[:];
+    editPage(admin, idA, mkMeta("aa", title="A2", isoDate="2020-10-01"));
+    app.runDueJobs();
+    assert proxy.purgeList == [
+        {"pages-default", "page-" + idA, "page-" + idB},
+    ];
+    # Responses to logged-in users aren't cached:
+    resp = admin.req("GET", "/aa");
+    assert resp["headers"]["CACHE-CONTROL"] == "private, no-store";
+    # Bulk deletion purges the whole blog:
+    del proxy.purgeList[:];
+    admin.req("POST", "/_resetPages", {});
+    app.runDueJobs();
+    assert proxy.purgeList == [{"blog-default"}];
+
+def test_failedPurgeIsRetried (pgUrl, proxy, noRetryDelay):
+    app = buildApp(pgUrl, proxy, cacheMaxAge=60);
+    admin = setupAdmin(app);
+    proxy.failCount = 1;
+    pageId = newPage(admin, mkMeta("aa"));
+    assert app.runDueJobs() == 2;       # Failed, then retried.
+    assert proxy.failCount == 0;
+    assert proxy.purgeList == [{"pages-default", "page-" + pageId}];
+    assert app.jobRunner.stats.retried == 1;
+    assert app.jobRunner.stats.done == 1;
+
+def test_noPurgeWhileCachingIsOff (pgUrl, proxy):
+    app = buildApp(pgUrl, proxy, cacheMaxAge=0);
+    admin = setupAdmin(app);
+    pageId = newPage(admin, mkMeta("aa"));
+    editPage(admin, pageId, mkMeta("aa", title="A2"));
+    deletePage(admin, pageId);
+    newPage(admin, mkMeta("bb"));
+    admin.req("POST", "/_resetPages", {});
+    assert app.runDueJobs() == 0;
+    assert proxy.purgeList == [];
+    resp = Client(app.wsgi).req("GET", "/");
+    assert resp["headers"]["CACHE-CONTROL"] == "no-cache";
@@ -0,0 +1,123 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Background jobs: run-once, dedup, retries and per-blog scoping.
+
+import time;
+import threading;
+import collections;
+
+import pogodb;
+import pytest;
+
+from vilolog import jobModel;
+
+@pytest.fixture
+def dbful (pgUrl):
+    dbful = pogodb.makeConnector(pgUrl, verbose=False);
+    call(dbful, jobModel.ensureTable);
+    return dbful;
+
+def call (dbful, fn, *args, **kwargs):
+    "Calls `fn(db, *args, **kwargs)`, in its own transaction.";
+    return dbful(lambda db: fn(db, *args, **kwargs))();
+
+def mkRecorder ():
+    "Returns a handler that counts calls per payload `n`, and its counter.";
+    counter = collections.Counter();
+    lock = threading.Lock();
+    def handler (db, payload):
+        with lock: counter[payload.n] += 1;
+    return (handler, counter);
+
+def test_eachJobRunsOnce (dbful):
+    (handler, counter) = mkRecorder();
+    @dbful
+    def enqueueAll (db):
+        for n in range(200):
+            jobModel.enqueue(db, "", "record", {"n": n});
+    enqueueAll();
+    runner = jobModel.mkJobRunner(dbful, "", {"record": handler},
+        workerCount=4, pollSecs=0.05,
+    );
+    runner.ensureStarted();
+    deadline = time.time() + 30;
+    while sum(counter.values()) < 200 and time.time() < deadline:
+        time.sleep(0.05);
+    runner.stop();
+    assert counter == {n: 1 for n in range(200)};
+    assert runner.stats.done == 200;
+    assert call(dbful, jobModel.getQueueStats, "").pending == 0;
+
+def test_dedupAndUpsert (dbful):
+    @dbful
+    def enqueueAll (db):
+        jobModel.enqueue(db, "", "record", {"n": 1}, dedupKey="k");
+        jobModel.enqueue(db, "", "record", {"n": 2}, dedupKey="k");
+        jobModel.enqueue(db, "", "record", {"n": 3}, dedupKey="u");
+        jobModel.enqueue(db, "", "record", {"n": 4}, dedupKey="u",
+            upsert=True,
+        );
+        jobModel.enqueue(db, "", "record", {"n": 5}, dedupKey="d");
+        jobModel.dequeue(db, "", "d");
+    enqueueAll();
+    (handler, counter) = mkRecorder();
+    runner = jobModel.mkJobRunner(dbful, "", {"record": handler}, 0);
+    while runner.workOnce(): pass;
+    assert counter == {1: 1, 4: 1};
+
+def test_delayedJobWaits (dbful):
+    call(dbful, jobModel.enqueue, "", "record", {"n": 1}, delaySecs=60);
+    (handler, counter) = mkRecorder();
+    runner = jobModel.mkJobRunner(dbful, "", {"record": handler}, 0);
+    assert runner.workOnce() is False;
+    assert call(dbful, jobModel.getQueueStats, "").pending == 1;
+
+def test_retriesThenFails (dbful, noRetryDelay):
+    calls = [];
+    def flaky (db, payload):
+        calls.append(payload.n);
+        if payload.n == 1 or calls.count(2) == 1:
+            raise ValueError("Flaky.");
+    call(dbful, jobModel.enqueue, "", "flaky", {"n": 1});
+    call(dbful, jobModel.enqueue, "", "flaky", {"n": 2});
+    runner = jobModel.mkJobRunner(dbful, "", {"flaky": flaky}, 0);
+    while runner.workOnce(): pass;
+    assert calls.count(1) == jobModel.JOB_MAX_ATTEMPTS;
+    assert calls.count(2) == 2;     # Failed once, then succeeded.
+    assert runner.stats.failed == 1;
+    queueStats = call(dbful, jobModel.getQueueStats, "");
+    assert (queueStats.pending, queueStats.failed) == (0, 1);
+
+def test_blogsDontShareJobs (dbful):
+    call(dbful, jobModel.enqueue, "a", "record", {"n": 1}, dedupKey="k");
+    call(dbful, jobModel.enqueue, "b", "record", {"n": 2}, dedupKey="k");
+    # ^ Same dedupKey, but different blogs; so both are kept.
+    (handler, counter) = mkRecorder();
+    runner = jobModel.mkJobRunner(dbful, "a", {"record": handler}, 0);
+    while runner.workOnce(): pass;
+    assert counter == {1: 1};
+    assert call(dbful, jobModel.getQueueStats, "b").pending == 1;
@@ -0,0 +1,62 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Sectionwise Markdown rendering must match whole-body rendering.
+
+import random;
+
+import pytest;
+
+from vilolog import markup;
+
+def renderSectionwise (body):
+    markup.htmlCache.reset();
+    return markup.renderMarkdown(body);
+
+def renderWhole (body):
+    return markup.convertMarkdown(body)[0];
+
+@pytest.mark.parametrize("body", [
+    "1. item\n\n    continued\n# H2\n\nx\n",
+    "* a\n\tcont\n> quote\n## H2\n\tcont\n",
+    "\tcont\n1. item\npara\n\n\tcont\n- item\n1. item\n# H\n\n",
+    "- a\n- b\n\n# H\n\ntext\n\n## H2\n\n1. x\n\n    y\n\n# H3\n",
+    "\n\n## H2\n",
+    "# A\n\n```\n# Not a heading\n```\n\n# B\n",
+])
+def test_sectionwiseMatchesWhole (body):
+    assert renderSectionwise(body) == renderWhole(body);
+
+def test_sectionwiseMatchesWhole_fuzz ():
+    pieceList = [
+        "1. item\n", "- item\n", "* a\n", "   - nested\n", "\n", "\n\n",
+        "    continued\n", "\tcont\n", "  two\n", "# H\n", "## H2\n",
+        "para\n", "> quote\n",
+    ];
+    rng = random.Random(0);
+    for _ in range(2000):
+        body = "".join(rng.choice(pieceList) for _ in range(rng.randint(2, 9)));
+        assert renderSectionwise(body) == renderWhole(body), body;
@@ -0,0 +1,73 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Media uploads: stored only for users who may upload.
+
+import os;
+import json;
+
+import pogodb;
+
+import vilolog;
+from testkit import setupAdmin;
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n";
+
+def listStoredFiles (mediaDir):
+    return sorted(
+        name for (dirPath, _, nameList) in os.walk(mediaDir)
+        for name in nameList
+    );
+
+def upload (client, body):
+    return client.req("POST", "/_uploadMedia?filename=x.png",
+        rawBody=body, contentType="image/png",
+        headers={"X-CSRF-Token": client.cookies["xCsrfToken"]},
+    );
+
+def test_uploadNeedsActiveUser (pgUrl, tmp_path):
+    mediaDir = str(tmp_path);
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, jobWorkerCount=0,
+        mediaDir=mediaDir, mediaWorkerCount=1,
+    );
+    admin = setupAdmin(app);
+    resp = upload(admin, PNG_MAGIC + b"first");
+    assert resp["code"] == 200;
+    sha = json.loads(resp["body"])["url"].split("/")[-1].split(".")[0];
+    app.variantExecutor.shutdown(wait=True);
+    assert listStoredFiles(mediaDir) == [sha + ".png"];
+    with pogodb.connect(pgUrl) as db:
+        db._execute("""
+            UPDATE pogotbl SET doc = jsonb_set(doc, '{role}', '"deactivated"')
+            WHERE doc->>'type' = 'user';
+        """);
+    resp = upload(admin, PNG_MAGIC + b"second");
+    assert resp["code"] != 200 and "deactivated" in resp["body"];
+    with pogodb.connect(pgUrl) as db:
+        db._execute("DELETE FROM pogotbl WHERE doc->>'type' = 'user';");
+    resp = upload(admin, PNG_MAGIC + b"third");
+    assert resp["code"] != 200 and "Session expired" in resp["body"];
+    assert listStoredFiles(mediaDir) == [sha + ".png"];
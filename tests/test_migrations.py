@@ -0,0 +1,113 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Schema migrations: stepwise upgrades, lazy upgrades upon read, and
+# bulk upgrades via `vilolog.migrateDocs(.)`.
+
+import dotsi;
+import pogodb;
+import pytest;
+
+import vilolog;
+from vilolog import migrations, pageModel;
+from testkit import Client, setupAdmin, mkMeta;
+
+def test_upgradeDoc ():
+    upgraderMap = {
+        0: lambda doc: doc.update({"version": 1, "a": 1}),
+        1: lambda doc: doc.update({"version": 2, "b": doc.a + 1}),
+    };
+    doc = dotsi.fy({"version": 0});
+    assert migrations.upgradeDoc(doc, upgraderMap, 2) is True;
+    assert doc == {"version": 2, "a": 1, "b": 2};
+    assert migrations.upgradeDoc(doc, upgraderMap, 2) is False;
+    with pytest.raises(AssertionError):
+        migrations.upgradeDoc(dotsi.fy({"version": 3}), upgraderMap, 2);
+        # ^ Newer than this code knows of.
+
+def insertOldPages (pgUrl, count):
+    "Inserts `count` v0 pages (i.e. sans `derived`). Returns their IDs.";
+    with pogodb.connect(pgUrl) as db:
+        author = db.findOne({"type": "user"});
+        idList = [];
+        for i in range(count):
+            isoDate = "2020-10-%02d" % (i % 28 + 1);
+            meta = mkMeta("old-%s" % i, isoDate=isoDate);
+            page = pageModel.buildPage(meta, "# Old %s\n\nBody.\n" % i,
+                author, "",
+            );
+            page.version = 0;
+            page.pop("derived");
+            db.insertOne(page);
+            idList.append(page._id);
+    return idList;
+
+def getStoredPage (pgUrl, pageId):
+    with pogodb.connect(pgUrl) as db:
+        return db.findById(pageId);     # As stored, w/o upgrading.
+
+def test_lazyUpgradeUponRead (pgUrl):
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, jobWorkerCount=0);
+    setupAdmin(app);
+    (pageId,) = insertOldPages(pgUrl, 1);
+    resp = Client(app.wsgi).req("GET", "/old-0");
+    assert resp["code"] == 200 and "Old 0" in resp["body"];
+    page = getStoredPage(pgUrl, pageId);
+    assert page.version == pageModel.PAGE_VERSION;
+    assert page.derived.toc[0].text == "Old 0";
+
+def test_writeBackSkipsChangedDocs (pgUrl):
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, jobWorkerCount=0);
+    setupAdmin(app);
+    (pageId,) = insertOldPages(pgUrl, 1);
+    page = getStoredPage(pgUrl, pageId);
+    pageModel.refreshDerived(page);
+    page.version = 1;
+    with pogodb.connect(pgUrl) as db:
+        assert migrations.writeBack(db, page, 0) == 1;
+        assert migrations.writeBack(db, page, 0) == 0;
+        # ^ Stored doc is no longer at v0, so it isn't overwritten.
+
+def test_migrateDocs (pgUrl):
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, jobWorkerCount=0);
+    setupAdmin(app);
+    idList = insertOldPages(pgUrl, 25);
+    result = vilolog.migrateDocs(pgUrl, batchSize=10, pauseSecs=0,
+        verbose=False,
+    );
+    assert result == {"page": 25, "user": 0};
+    for pageId in idList:
+        page = getStoredPage(pgUrl, pageId);
+        assert page.version == pageModel.PAGE_VERSION;
+        assert pageModel.validatePage(page, "");
+    with pogodb.connect(pgUrl) as db:
+        rowList = db._execute("""
+            SELECT indexname FROM pg_indexes WHERE tablename = 'pogotbl';
+        """, fetch="all");
+    indexNameSet = set(row.indexname for row in rowList);
+    for (indexName, _) in pageModel.PAGE_INDEX_LIST:
+        assert indexName in indexNameSet;
+    assert vilolog.migrateDocs(pgUrl, verbose=False) == {"page": 0, "user": 0};
@@ -0,0 +1,124 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Scheduled publishing, via delayed `publishPage` jobs.
+
+import time;
+
+import pogodb;
+
+import vilolog;
+from vilolog import jobModel, pageModel, revisionModel;
+from testkit import Client, holdJobWorkers, setupAdmin;
+from testkit import mkMeta, newPage, editPage, deletePage;
+
+def fmtPublishAt (secsFromNow):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ",
+        time.gmtime(time.time() + secsFromNow),
+    );
+
+def getPendingJobList (pgUrl):
+    with pogodb.connect(pgUrl) as db:
+        return db._execute("""
+            SELECT kind, payload FROM vilolog_job WHERE status = 'pending';
+        """, fetch="all");
+
+def makeJobsDue (pgUrl):
+    "Fast-forwards pending jobs, rather than waiting for them.";
+    with pogodb.connect(pgUrl) as db:
+        db._execute("UPDATE vilolog_job SET run_at = now();");
+
+def buildApp (pgUrl):
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, jobWorkerCount=1);
+    return holdJobWorkers(app);
+
+def test_scheduledPageIsPublished (pgUrl):
+    app = buildApp(pgUrl);
+    admin = setupAdmin(app);
+    anon = Client(app.wsgi);
+    publishAt = fmtPublishAt(3600);
+    pageId = newPage(admin, mkMeta("aa", tags=["x"], publishAt=publishAt));
+    # Forced to be a draft until then:
+    assert anon.req("GET", "/aa")["code"] == 404;
+    with pogodb.connect(pgUrl) as db:
+        assert pageModel.getPage(db, pageId, "").meta.isDraft is True;
+        assert pageModel.getPageStats(db, "").tagCounts == [];
+    assert app.runDueJobs() == 0;   # Not yet due.
+    (job,) = getPendingJobList(pgUrl);
+    assert (job.kind, job.payload.publishAt) == ("publishPage", publishAt);
+    makeJobsDue(pgUrl);
+    assert app.runDueJobs() == 1;
+    assert anon.req("GET", "/aa")["code"] == 200;
+    with pogodb.connect(pgUrl) as db:
+        assert pageModel.getPageStats(db, "").tagCounts == [["x", 1]];
+        revision = revisionModel.getRevision(db, pageId, 1);
+        assert revision.meta.isDraft is False;
+
+def test_rescheduleAndUnschedule (pgUrl):
+    app = buildApp(pgUrl);
+    admin = setupAdmin(app);
+    pageId = newPage(admin, mkMeta("aa", publishAt=fmtPublishAt(3600)));
+    later = fmtPublishAt(7200);
+    editPage(admin, pageId, mkMeta("aa", publishAt=later));
+    (job,) = getPendingJobList(pgUrl);     # Rescheduled, not duplicated.
+    assert job.payload.publishAt == later;
+    editPage(admin, pageId, mkMeta("aa", isDraft=True));
+    assert getPendingJobList(pgUrl) == [];  # Unscheduled.
+
+def test_stalePublishJobIsSkipped (pgUrl):
+    app = buildApp(pgUrl);
+    admin = setupAdmin(app);
+    pageId = newPage(admin, mkMeta("aa", publishAt=fmtPublishAt(3600)));
+    deletePage(admin, pageId);
+    assert getPendingJobList(pgUrl) == [];  # Dropped along w/ the page.
+    otherId = newPage(admin, mkMeta("bb", publishAt=fmtPublishAt(3600)));
+    with pogodb.connect(pgUrl) as db:
+        page = pageModel.getPage(db, otherId, "");
+        page.meta.publishAt = fmtPublishAt(7200);
+        pageModel.replacePage(db, page, "");
+        # ^ Rescheduled w/o updating the job, which must thus be skipped.
+    makeJobsDue(pgUrl);
+    assert app.runDueJobs() == 1;
+    with pogodb.connect(pgUrl) as db:
+        assert pageModel.getPage(db, otherId, "").meta.isDraft is True;
+        assert jobModel.getQueueStats(db, "").failed == 0;
+
+def test_pastOrInvalidPublishAt (pgUrl):
+    app = buildApp(pgUrl);
+    admin = setupAdmin(app);
+    newPage(admin, mkMeta("aa", publishAt=fmtPublishAt(-60)));
+    assert Client(app.wsgi).req("GET", "/aa")["code"] == 200;
+    assert getPendingJobList(pgUrl) == [];
+    for publishAt in ["2020-13-01T00:00:00Z", "2020-10-01 00:00:00"]:
+        resp = admin.req("POST", "/_newPage", {
+            "meta": '{"title": "B", "slug": "bb", "isoDate": "2020-10-01",'
+                ' "template": "page.html", "isDraft": false,'
+                ' "publishAt": "%s"}' % publishAt,
+            "body": "Hello.",
+        });
+        assert resp["code"] >= 400;
+    with pogodb.connect(pgUrl) as db:
+        assert pageModel.getPageBySlug(db, "bb", "") is None;
@@ -0,0 +1,87 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Page revisions: line deltas, snapshots, diffs and restores.
+
+import random;
+
+import pogodb;
+
+import vilolog;
+from vilolog import pageModel, revisionModel;
+from testkit import setupAdmin, mkMeta, newPage, editPage, deletePage;
+
+def test_deltaRoundTrip ():
+    rng = random.Random(0);
+    wordList = ["alpha\n", "beta\n", "gamma\n", "", "delta", "\n"];
+    mkBody = lambda: "".join(rng.choice(wordList) for _ in range(20));
+    for _ in range(500):
+        (oldBody, newBody) = (mkBody(), mkBody());
+        delta = revisionModel.computeDelta(oldBody, newBody);
+        assert revisionModel.applyDelta(oldBody, delta) == newBody;
+
+def test_revisionsAreReconstructed (pgUrl):
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, jobWorkerCount=0);
+    admin = setupAdmin(app);
+    bodyList = ["line %s\n" % i * 3 + "common\n" for i in range(25)];
+    pageId = newPage(admin, mkMeta("aa"), bodyList[0]);
+    for body in bodyList[1:]:
+        assert editPage(admin, pageId, mkMeta("aa"), body)["code"] == 200;
+    editPage(admin, pageId, mkMeta("aa"), bodyList[-1]);   # Unchanged.
+    with pogodb.connect(pgUrl) as db:
+        assert revisionModel.getLatestSeq(db, pageId) == len(bodyList) - 1;
+        for (seq, body) in enumerate(bodyList):
+            revision = revisionModel.getRevision(db, pageId, seq);
+            assert revision.body == body;
+            assert revision.isSnapshot == (
+                seq % revisionModel.SNAPSHOT_INTERVAL == 0
+            );
+        assert revisionModel.getRevision(db, pageId, len(bodyList)) is None;
+    resp = admin.req("GET", "/_revisions/%s?diff=1" % pageId);
+    assert resp["code"] == 200;
+    assert "+line 1" in resp["body"] and "-line 0" in resp["body"];
+
+def test_restoreRevision (pgUrl):
+    app = vilolog.buildApp(pgUrl, bcryptRounds=4, jobWorkerCount=0);
+    admin = setupAdmin(app);
+    pageId = newPage(admin, mkMeta("aa", tags=["x"]), "First.\n");
+    editPage(admin, pageId, mkMeta("bb", tags=["y"]), "Second.\n");
+    resp = admin.req("POST", "/_restoreRevision/" + pageId, {"seq": "0"});
+    assert resp["code"] == 302;
+    with pogodb.connect(pgUrl) as db:
+        page = pageModel.getPage(db, pageId, "");
+        assert (page.meta.slug, page.body) == ("aa", "First.\n");
+        assert revisionModel.getLatestSeq(db, pageId) == 2;
+        assert pageModel.getPageStats(db, "").tagCounts == [["x", 1]];
+    # Restoring a slug that's since been taken is refused:
+    newPage(admin, mkMeta("bb"));
+    resp = admin.req("POST", "/_restoreRevision/" + pageId, {"seq": "1"});
+    assert resp["code"] != 302;
+    assert "slug now taken" in resp["body"];
+    # Deleting a page deletes its revisions:
+    deletePage(admin, pageId);
+    with pogodb.connect(pgUrl) as db:
+        assert revisionModel.getLatestSeq(db, pageId) is None;
@@ -0,0 +1,120 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Helpers for tests: a WSGI client, and shortcuts for common admin steps.
+
+import io;
+import json;
+import re;
+import http.cookies;
+import urllib.parse;
+
+class Client:
+    "Minimal WSGI client, which keeps cookies and sends the anti-CSRF token.";
+
+    def __init__ (self, wsgi, host="localhost:8080"):
+        self.wsgi = wsgi;
+        self.host = host;
+        self.cookies = {};
+
+    def req (self, verb, path, data=None, headers=None, rawBody=None,
+            contentType="application/x-www-form-urlencoded",
+        ):
+        "Sends a request (w/ `data` url-encoded). Returns a response dict.";
+        path, _, qs = path.partition("?");
+        body = rawBody or b"";
+        if data is not None:
+            data = dict(data);
+            if verb != "GET" and "xCsrfToken" in self.cookies:
+                data.setdefault("xCsrfToken", self.cookies["xCsrfToken"]);
+            body = urllib.parse.urlencode(data).encode("utf8");
+        environ = {
+            "REQUEST_METHOD": verb, "PATH_INFO": path, "QUERY_STRING": qs,
+            "wsgi.input": io.BytesIO(body), "wsgi.url_scheme": "http",
+            "HTTP_HOST": self.host, "REMOTE_ADDR": "127.0.0.1",
+            "CONTENT_LENGTH": str(len(body)),
+            "CONTENT_TYPE": contentType,
+            "HTTP_COOKIE": "; ".join(
+                '%s="%s"' % pair for pair in self.cookies.items()
+            ),
+        };
+        for (name, value) in (headers or {}).items():
+            environ["HTTP_" + name.upper().replace("-", "_")] = value;
+        out = {};
+        def startResponse (status, headerList):
+            out.update({"status": status, "headerList": headerList});
+        out["body"] = b"".join(self.wsgi(environ, startResponse)).decode();
+        out["code"] = int(out["status"].split()[0]);
+        out["headers"] = {n.upper(): v for (n, v) in out["headerList"]};
+        for (name, value) in out["headerList"]:
+            if name.upper() == "SET-COOKIE":
+                cookie = http.cookies.SimpleCookie();
+                cookie.load(value);
+                for (key, morsel) in cookie.items():
+                    self.cookies[key] = morsel.value;
+        return out;
+
+def holdJobWorkers (app):
+    "Keeps `app`'s job workers from starting. Run jobs via app.runDueJobs().";
+    app.jobRunner.ensureStarted = lambda: None;
+    return app;
+
+def setupAdmin (app, email="admin@example.com", password="pw"):
+    "Creates the blog's first (admin) user. Returns a logged-in client.";
+    client = Client(app.wsgi);
+    client.req("POST", "/_setup", {
+        "name": "Admin", "email": email, "password": password,
+    });
+    assert client.req("POST", "/_login", {
+        "email": email, "password": password,
+    })["code"] == 302;
+    return client;
+
+def mkMeta (slug, **kwargs):
+    "Returns page meta (as a dict), with `kwargs` overriding defaults.";
+    meta = {
+        "title": slug.title(), "slug": slug, "isoDate": "2020-10-01",
+        "template": "page.html", "isDraft": False, "tags": [],
+    };
+    meta.update(kwargs);
+    return meta;
+
+def newPage (client, meta, body="Hello."):
+    "Creates a page via the admin UI. Returns its ID.";
+    resp = client.req("POST", "/_newPage", {
+        "meta": json.dumps(meta), "body": body,
+    });
+    idList = re.findall(r"/_editPage/(\w+)", resp["body"]);
+    assert idList, resp["status"];
+    return idList[0];
+
+def editPage (client, pageId, meta, body="Hello."):
+    return client.req("POST", "/_editPage/" + pageId, {
+        "meta": json.dumps(meta), "body": body,
+    });
+
+def deletePage (client, pageId):
+    return client.req("POST", "/_deletePage", {"pageId": pageId});
@@ -0,0 +1,114 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+import functools;
+import contextlib;
+import threading;
+
+import dotsi;
+import pogodb;
+import psycopg2;
+import psycopg2.pool;
+import psycopg2.extras;
+
+from . import utils;
+
+ITER_FETCH_SIZE = 200;  # Rows per round-trip, for server-side cursors.
+
+# Unlike pogodb.makeConnector(.), which opens (and closes) a
+# fresh Postgres connection per call, connectors built here
+# borrow connections from a fixed-size, thread-safe pool.
+# Callers block (rather than error) if the pool is exhausted.
+
+def makePooledConnector (pgUrl, poolSize, skipSetup=False, verbose=False):
+    "Returns a `db`-supplying decorator, backed by a connection pool.";
+    assert type(poolSize) is int and poolSize >= 1;
+    pool = psycopg2.pool.ThreadedConnectionPool(0, poolSize, pgUrl);
+    slots = threading.BoundedSemaphore(poolSize);
+    ref = dotsi.fy({"skip1st": skipSetup, "used1st": False});
+
+    @contextlib.contextmanager
+    def connect ():
+        "Returns a context-managed `db`, bound to a pooled connection.";
+        if not ref.used1st:
+            shouldSkip = ref.skip1st;
+            ref.used1st = True;
+        else:
+            shouldSkip = True;
+        with slots:
+            con = pool.getconn();
+            try:
+                with con:
+                    cur = con.cursor(cursor_factory=psycopg2.extras.RealDictCursor);
+                    with cur:
+                        yield pogodb.bindConCur(con, cur, shouldSkip, verbose);
+            finally:
+                # Note: `with con` commits/rolls-back, but doesn't close.
+                pool.putconn(con, close=bool(con.closed));
+
+    def dbConnector (fn):
+        @functools.wraps(fn)
+        def wrapper (*args, **kwargs):
+            with connect() as db:
+                return fn(db=db, *args, **kwargs);
+        return wrapper;
+    def prime ():
+        "Opens (upto) `poolSize` connections upfront. Returns count.";
+        conList = [];
+        while len(conList) < poolSize and slots.acquire(blocking=False):
+            conList.append(pool.getconn());
+        for con in conList:
+            pool.putconn(con);
+            slots.release();
+        return len(conList);
+
+    dbConnector.connect = connect;
+    dbConnector.closeAll = pool.closeall;
+    dbConnector.prime = prime;
+    return dbConnector;
+
+def iterSql (db, stmt, args=None, fetchSize=ITER_FETCH_SIZE):
+    "Yields rows of `stmt`, fetched in batches via a server-side cursor.";
+    # Named cursors live within the current transaction, so the
+    # returned generator must be consumed before `db` is released.
+    cur = db._con.cursor(
+        name="vilolog_iter_" + utils.genId(),
+        cursor_factory=psycopg2.extras.RealDictCursor,
+    );
+    cur.itersize = fetchSize;
+    try:
+        cur.execute(stmt, args);
+        while True:
+            rowList = cur.fetchmany(fetchSize);
+            if not rowList:
+                return;
+            for row in rowList:
+                yield dotsi.Dict(row);
+    finally:
+        try:
+            cur.close();
+        except psycopg2.Error:
+            pass;   # Transaction already aborted, cursor's gone.
@@ -0,0 +1,238 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+import os;
+import json;
+import threading;
+import traceback;
+
+import dotsi;
+
+# Jobs live in a dedicated table, in the same database. A job is
+# enqueued within the request's transaction, so it becomes visible
+# (to workers) only if and when that transaction commits. Workers
+# claim jobs via `FOR UPDATE SKIP LOCKED`, so concurrent workers,
+# across threads and processes, never contend for the same job.
+# A job's effects and its deletion are committed together.
+# Blogs share the table, but each job is tagged with its `blog_id`,
+# and is only ever claimed by workers of the same blog.
+
+JOB_MAX_ATTEMPTS = 5;
+JOB_RETRY_BASE_SECS = 5;        # Backoff: 5s, 10s, 20s, ...
+JOB_RETRY_MAX_SECS = 3600;
+JOB_LEASE_SECS = 300;           # Running jobs older than this are reclaimed.
+JOB_POLL_SECS = 2;
+
+def ensureTable (db):
+    db._execute("""
+        CREATE TABLE IF NOT EXISTS vilolog_job (
+            id BIGSERIAL PRIMARY KEY,
+            blog_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            dedup_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            locked_at TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS vilolog_job_dedup
+        ON vilolog_job (blog_id, dedup_key) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS vilolog_job_pending
+        ON vilolog_job (blog_id, run_at, id) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS vilolog_job_running
+        ON vilolog_job (locked_at) WHERE status = 'running';
+    """);
+    # ^ Dedup only applies to pending jobs. Thus, a job enqueued
+    #   while an equivalent one is running isn't dropped.
+
+def enqueue (db, blogId, kind, payload=None, dedupKey=None, delaySecs=0,
+        upsert=False,
+    ):
+    "Enqueues a job. If `dedupKey` is already pending, it's a no-op.";
+    # With `upsert`, the pending job's payload & run_at are updated instead.
+    db._execute("""
+        INSERT INTO vilolog_job (blog_id, kind, payload, dedup_key, run_at)
+        VALUES (%s, %s, %s, %s, now() + %s * INTERVAL '1 second')
+        ON CONFLICT (blog_id, dedup_key) WHERE status = 'pending'
+        DO {onConflict};
+    """.format(onConflict=(
+        "UPDATE SET payload = EXCLUDED.payload, run_at = EXCLUDED.run_at"
+        if upsert else "NOTHING"
+    )), [blogId, kind, json.dumps(payload or {}), dedupKey, delaySecs]);
+
+def dequeue (db, blogId, dedupKey):
+    "Deletes the pending job with `dedupKey`, if any.";
+    db._execute("""
+        DELETE FROM vilolog_job
+        WHERE blog_id = %s AND dedup_key = %s AND status = 'pending';
+    """, [blogId, dedupKey]);
+
+def claimJob (db, blogId):
+    "Claims the blog's next due job, if any. Returns job or None.";
+    rowList = db._execute("""
+        UPDATE vilolog_job SET
+            status = 'running', attempts = attempts + 1, locked_at = now()
+        WHERE id = (
+            SELECT id FROM vilolog_job
+            WHERE blog_id = %s AND (
+                (status = 'pending' AND run_at <= now()) OR (
+                    status = 'running' AND
+                    locked_at < now() - %s * INTERVAL '1 second'
+                )
+            )
+            ORDER BY run_at, id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, payload, dedup_key AS "dedupKey", attempts;
+    """, [blogId, JOB_LEASE_SECS], fetch="all");
+    return rowList[0] if rowList else None;
+
+def completeJob (db, job):
+    db._execute("DELETE FROM vilolog_job WHERE id = %s;", [job.id]);
+
+def failJob (db, job, errText):
+    "Schedules a retry with exponential backoff, or marks job as 'failed'.";
+    if job.attempts >= JOB_MAX_ATTEMPTS:
+        db._execute("""
+            UPDATE vilolog_job SET status = 'failed', last_error = %s
+            WHERE id = %s;
+        """, [errText, job.id]);
+        return "failed";
+    delaySecs = min(
+        JOB_RETRY_BASE_SECS * 2 ** (job.attempts - 1), JOB_RETRY_MAX_SECS,
+    );
+    db._execute("""
+        UPDATE vilolog_job AS j SET
+            status = 'pending', locked_at = NULL, last_error = %s,
+            run_at = now() + %s * INTERVAL '1 second'
+        WHERE j.id = %s AND NOT EXISTS (
+            SELECT 1 FROM vilolog_job
+            WHERE status = 'pending' AND dedup_key = j.dedup_key
+            AND blog_id = j.blog_id
+        );
+    """, [errText, delaySecs, job.id]);
+    if db._cur.rowcount == 0:
+        completeJob(db, job);   # An equivalent job is already pending.
+        return "superseded";
+    return "retrying";
+
+def getQueueStats (db, blogId):
+    "Returns the blog's job counts by status, & the age of its oldest due job.";
+    rowList = db._execute("""
+        SELECT status, COUNT(*) AS n, EXTRACT(EPOCH FROM
+            now() - MIN(run_at) FILTER (WHERE run_at <= now())
+        ) AS "maxLagSecs"
+        FROM vilolog_job WHERE blog_id = %s GROUP BY status;
+    """, [blogId], fetch="all");
+    stats = dotsi.fy({"pending": 0, "running": 0, "failed": 0, "maxLagSecs": 0});
+    for row in rowList:
+        stats[row.status] = row.n;
+        if row.status == "pending":
+            stats.maxLagSecs = round(float(row.maxLagSecs or 0), 3);
+    return stats;
+
+def mkJobRunner (dbful, blogId, handlerMap, workerCount=2,
+        pollSecs=JOB_POLL_SECS,
+    ):
+    "Makes a runner (for `blogId`'s jobs) w/ lazily started worker threads.";
+    # Each handler is called as `handler(db, payload)`.
+    lock = threading.Lock();
+    state = dotsi.fy({"pid": None, "threadList": []});
+    stopEvent = threading.Event();
+    stats = dotsi.fy({"done": 0, "retried": 0, "failed": 0});
+
+    @dbful
+    def claim (db):
+        return claimJob(db, blogId);    # Commits claim, before running.
+
+    @dbful
+    def run (job, db):
+        handlerMap[job.kind](db, job.payload);
+        completeJob(db, job);       # Commits along w/ job's effects.
+
+    @dbful
+    def fail (job, errText, db):
+        return failJob(db, job, errText);
+
+    def bump (counterName):
+        with lock: stats[counterName] += 1;
+
+    def workOnce ():
+        "Runs the next due job, if any. Returns True if a job was run.";
+        job = claim();
+        if not job:
+            return False;
+        try:
+            run(job);
+            bump("done");
+        except Exception:
+            errText = traceback.format_exc();
+            print("\n" + errText + "\n");
+            outcome = fail(job, errText);
+            bump("failed" if outcome == "failed" else "retried");
+        return True;
+
+    def workLoop ():
+        while not stopEvent.is_set():
+            try:
+                if workOnce():
+                    continue;
+            except Exception:
+                print("\n" + traceback.format_exc() + "\n");
+            stopEvent.wait(pollSecs);
+
+    def ensureStarted ():
+        if state.pid == os.getpid():
+            return;     # Already started, in this process.
+        with lock:
+            if state.pid == os.getpid():
+                return;
+            stopEvent.clear();
+            state.pid = os.getpid();
+            state.threadList = [
+                threading.Thread(
+                    target=workLoop, daemon=True,
+                    name="vilolog-job-%s" % i,
+                )
+                for i in range(workerCount)
+            ];
+            for thread in state.threadList:
+                thread.start();
+
+    def stop ():
+        stopEvent.set();
+        for thread in state.threadList:
+            thread.join();
+        state.update({"pid": None, "threadList": []});
+
+    return dotsi.fy({
+        "ensureStarted": ensureStarted, "stop": stop,
+        "workOnce": workOnce, "stats": stats,
+    });
@@ -0,0 +1,118 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+import time;
+import hashlib;
+import threading;
+
+import dotsi;
+
+# Token buckets live in a dedicated table (not in pogotbl), so
+# that they're shared across worker processes and servers. Each
+# take is a single atomic upsert; refill is computed lazily,
+# using Postgres' clock, from the time elapsed since last take.
+# A bucket left idle until it's full is equivalent to no bucket,
+# so such rows are pruned periodically, bounding the table's size.
+
+PRUNE_INTERVAL_SECS = 60;   # Per process.
+
+def ensureTable (db):
+    db._execute("""
+        CREATE TABLE IF NOT EXISTS vilolog_throttle (
+            key TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            taken BOOLEAN NOT NULL,
+            updated_at DOUBLE PRECISION NOT NULL
+        );
+    """);
+
+def takeToken (db, key, ratePerMin, burst):
+    "Takes a token from bucket `key`. Returns False if empty.";
+    now = "EXTRACT(EPOCH FROM clock_timestamp())";
+    refill = """LEAST(%(burst)s,
+        t.tokens + ({now} - t.updated_at) * %(ratePerSec)s
+    )""".format(now=now);
+    row = db._execute("""
+        INSERT INTO vilolog_throttle AS t (key, tokens, taken, updated_at)
+        VALUES (%(key)s, %(burst)s - 1, TRUE, {now})
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = {refill} - (CASE WHEN {refill} >= 1 THEN 1 ELSE 0 END),
+            taken = ({refill} >= 1),
+            updated_at = {now}
+        RETURNING taken;
+    """.format(now=now, refill=refill), {
+        "key": key, "burst": burst, "ratePerSec": ratePerMin / 60.0,
+    }, fetch="one");
+    return row.taken;
+
+def pruneBuckets (db, maxIdleSecs):
+    "Deletes buckets that have been idle for over `maxIdleSecs`.";
+    db._execute("""
+        DELETE FROM vilolog_throttle
+        WHERE updated_at < EXTRACT(EPOCH FROM clock_timestamp()) - %s;
+    """, [maxIdleSecs]);
+
+def countEmptyBuckets (db):
+    "Counts buckets that were empty as of their latest take.";
+    row = db._execute("""
+        SELECT COUNT(*) AS n FROM vilolog_throttle WHERE NOT taken;
+    """, fetch="one");
+    return row.n;
+
+def mkLoginThrottle (ratePerMin, burst):
+    "Makes a throttle w/ per-IP and per-email buckets, and counters.";
+    assert ratePerMin > 0 and burst >= 1;
+    lock = threading.Lock();
+    stats = dotsi.fy({"allowed": 0, "rejectedByIp": 0, "rejectedByEmail": 0});
+    refillSecs = burst / (ratePerMin / 60.0);   # From empty to full.
+    pruneRef = dotsi.fy({"nextAt": 0});
+    
+    def bump (counterName):
+        with lock: stats[counterName] += 1;
+
+    def maybePrune (db):
+        with lock:
+            if time.time() < pruneRef.nextAt:
+                return;
+            pruneRef.nextAt = time.time() + PRUNE_INTERVAL_SECS;
+        pruneBuckets(db, refillSecs);
+
+    def check (db, ip, email):
+        "Returns True if a login attempt by `ip` for `email` is allowed.";
+        maybePrune(db);
+        if not takeToken(db, "login-ip:" + ip, ratePerMin, burst):
+            bump("rejectedByIp");
+            return False;
+        email = (email or "").strip().lower();
+        emailHash = hashlib.sha256(email.encode("utf8")).hexdigest();
+        # ^ Fixed-length keys, however long the submitted email.
+        if not takeToken(db, "login-email:" + emailHash, ratePerMin, burst):
+            bump("rejectedByEmail");
+            return False;
+        bump("allowed");
+        return True;
+    
+    return dotsi.fy({"check": check, "stats": stats});
@@ -0,0 +1,202 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+import re;
+import html;
+import math;
+import hashlib;
+import copy;
+
+import dotsi;
+
+from . import utils;
+from . import mediaModel;
+
+MD_EXTENSIONS = ["fenced_code", "toc"];
+# ^ 'toc' adds `id` attrs to headings, for use as anchors.
+WORDS_PER_MINUTE = 200;
+EXCERPT_WORD_LIMIT = 50;
+HTML_CACHE_MAX_CHARS = 32 * 1024 * 1024;
+DERIVED_CACHE_MAX_COUNT = 256;
+SRCSET_CACHE_MAX_COUNT = 4096;
+SRCSET_CACHE_TTL = 60;  # Variants appear (but never vanish) over time.
+
+# Memoization, keyed by content hash:
+htmlCache = utils.mkLruCache(HTML_CACHE_MAX_CHARS, weigh=len);
+derivedCache = utils.mkLruCache(DERIVED_CACHE_MAX_COUNT);
+srcsetCache = utils.mkLruCache(SRCSET_CACHE_MAX_COUNT, ttl=SRCSET_CACHE_TTL);
+
+mediaDirRef = dotsi.fy({"path": None});
+# ^ Set by `buildApp(.)`, for checking which variants exist on disk.
+#   Process-wide, like the caches above.
+
+IMG_SIZES_ATTR = "(max-width: 720px) 100vw, 720px"; # Default theme's width.
+
+LIST_LINE_RE = r"^([ \t]+\S| {0,3}([*+-]|\d+[.)])[ \t])";
+FENCE_OPENER_RE = r"^(~{3,}|`{3,})[ ]*(\{[^\n]*\}|\.?[\w#.+-]*[ ]*)$";
+# ^ Simple fenced_code openers, like "```", "~~~~ python" or "``` {.py}".
+
+hashText = lambda text: hashlib.sha256(utils._b(text)).hexdigest();
+
+def mediaSrcset (url):
+    "Returns `srcset` for `url` if it points to uploaded media, else ''.";
+    match = re.match("^" + mediaModel.MEDIA_URL_RE + "$", url or "");
+    if not match or match.group(2) == "gif" or not mediaDirRef.path:
+        return "";
+    srcset = srcsetCache.lookup(url);
+    if srcset is None:
+        srcset = srcsetCache.store(url, mediaModel.buildSrcset(
+            mediaDirRef.path, match.group(1), match.group(2),
+        ));
+    return srcset;
+
+def addMediaSrcset (bodyHtml):
+    "Adds `srcset` etc. to <img> tags that point to uploaded media.";
+    def replacer (match):
+        imgTag = match.group(0);
+        srcMatch = re.search(r"\ssrc=\"([^\"]*)\"", imgTag);
+        srcset = srcMatch and mediaSrcset(srcMatch.group(1));
+        if not srcset or "srcset=" in imgTag:
+            return imgTag;
+        return '<img srcset="%s" sizes="%s" loading="lazy"%s' % (
+            srcset, IMG_SIZES_ATTR, imgTag[len("<img") : ],
+        );
+    return re.sub(r"<img\s[^>]*>", replacer, bodyHtml);
+
+def convertMarkdown (body):
+    "Converts Markdown `body` to HTML. Returns [html, tocTokens].";
+    import markdown;    # Lazy; imported upfront by app.warmUp(), if called.
+    md = markdown.Markdown(extensions=MD_EXTENSIONS);
+    bodyHtml = addMediaSrcset(md.convert(body));
+    return [bodyHtml, md.toc_tokens];
+
+def splitSections (body):
+    "Splits `body` at ATX headings, or returns None if unsafe to do so.";
+    # Sections are rendered (and memoized) independently, so that an
+    # edit to one section doesn't require re-rendering the others.
+    # That's only safe if no Markdown construct spans sections:
+    if re.search(r"^ {0,3}(\[[^\]]+\]:|<[a-zA-Z!/?])", body, re.M):
+        return None;    # Reference-style link defs, or raw HTML blocks.
+    sectionList, lineList = [], [];
+    fence = None;       # Opening fence (like "````"), while in a fence.
+    prevLine = "";
+    listSeen = False;   # If a list item or indented line is in this section.
+    for line in body.splitlines(True):
+        if fence:
+            if re.match(r"^%s[ ]*$" % re.escape(fence), line.rstrip("\r\n")):
+                fence = None;   # Closed by the very same fence, as w/ fenced_code.
+        elif re.match(r"^(~{3,}|`{3,})", line):
+            fenceMatch = re.match(FENCE_OPENER_RE, line.rstrip("\r\n"));
+            if not fenceMatch:
+                return None;    # Unusual opener, leave it to Markdown.
+            fence = fenceMatch.group(1);
+        elif re.match(r"^ {0,3}(=+|-+)[ \t]*$", line) and prevLine.strip():
+            return None;    # Setext heading (or ambiguous), spans lines.
+        elif re.match(r"^#{1,6}\s", line):
+            if listSeen and prevLine.strip():
+                return None;    # May be lazily continuing a list item.
+            if lineList:
+                sectionList.append("".join(lineList));
+            lineList = [];
+            listSeen = False;
+        elif re.match(LIST_LINE_RE, line):
+            listSeen = True;
+        lineList.append(line);
+        prevLine = line;
+    if fence:
+        return None;    # Unclosed fence.
+    if lineList:
+        sectionList.append("".join(lineList));
+    return sectionList;
+
+def renderMemo (text):
+    "Memoized Markdown-to-HTML conversion of `text`.";
+    key = hashText(text);
+    textHtml = htmlCache.lookup(key);
+    if textHtml is None:
+        textHtml = htmlCache.store(key, convertMarkdown(text)[0]);
+    return textHtml;
+
+def renderMarkdown (body):
+    "Converts Markdown `body` to HTML, memoizing whole and sectionwise.";
+    key = hashText(body);
+    bodyHtml = htmlCache.lookup(key);
+    if bodyHtml is not None:
+        return bodyHtml;
+    sectionList = splitSections(body);
+    if sectionList is None or len(sectionList) == 1:
+        bodyHtml = convertMarkdown(body)[0];
+    else:
+        bodyHtml = "\n".join(filter(None, map(renderMemo, sectionList)));
+        idList = re.findall(r"<h[1-6] id=\"([^\"]*)\"", bodyHtml);
+        if len(set(idList)) != len(idList):
+            bodyHtml = convertMarkdown(body)[0];
+            # ^ Whole-body render de-duplicates ids, like 'foo', 'foo_1'.
+    return htmlCache.store(key, bodyHtml);
+
+def htmlToText (someHtml):
+    "Strips tags from `someHtml`, returns whitespace-normalized text.";
+    text = html.unescape(re.sub(r"<[^>]+>", " ", someHtml));
+    text = " ".join(text.split());
+    return re.sub(r" ([.,;:!?])", r"\1", text);  # "word ." -> "word."
+
+def flattenToc (tocTokens):
+    "Flattens (nested) `tocTokens` into an outline list.";
+    outline = [];
+    for token in tocTokens:
+        outline.append({
+            "level": token["level"],
+            "text": html.unescape(token["name"]),
+            "anchor": token["id"],
+        });
+        outline.extend(flattenToc(token["children"]));
+    return outline;
+
+def computeDerived (body):
+    "Computes excerpt, word count, etc. from Markdown `body`.";
+    key = hashText(body);
+    derived = derivedCache.lookup(key);
+    if derived is None:
+        derived = derivedCache.store(key, _computeDerived(body));
+    return copy.deepcopy(derived);  # Callers may mutate the result.
+
+def _computeDerived (body):
+    bodyHtml, tocTokens = convertMarkdown(body);
+    proseHtml = re.sub(r"<pre>.*?</pre>", " ", bodyHtml, flags=re.S);
+    wordCount = len(htmlToText(proseHtml).split());
+    paraText = htmlToText(" ".join(re.findall(r"<p>(.*?)</p>", bodyHtml, re.S)));
+    paraWords = paraText.split();
+    excerpt = " ".join(paraWords[ : EXCERPT_WORD_LIMIT]);
+    if len(paraWords) > EXCERPT_WORD_LIMIT:
+        excerpt += " ...";
+    imgMatch = re.search(r"<img[^>]*\ssrc=\"([^\"]*)\"", bodyHtml);
+    return {
+        "excerpt": excerpt,
+        "wordCount": wordCount,
+        "readingMins": max(1, math.ceil(wordCount / WORDS_PER_MINUTE)),
+        "toc": flattenToc(tocTokens),
+        "firstImage": html.unescape(imgMatch.group(1)) if imgMatch else None,
+    };
@@ -0,0 +1,206 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+import os;
+import re;
+import hashlib;
+import tempfile;
+
+import dotsi;
+
+from . import utils;
+
+# Media files are content-addressed: each is stored (once) on disk
+# as `<mediaDir>/<sha[:2]>/<sha>.<ext>`, and is served at the URL
+# `/_media/<sha>.<ext>`. Resized variants, generated in the
+# background, are stored alongside as `<sha>-w<width>.<ext>`.
+# As contents never change for a given name, all such files can
+# be cached immutably.
+
+MEDIA_VERSION = 0;
+VARIANT_WIDTHS = [480, 960, 1440];
+CHUNK_SIZE = 64 * 1024;
+MIME_EXT_MAP = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+};
+MAGIC_EXT_LIST = [
+    # [leadingBytes, ext]
+    [b"\xff\xd8\xff", "jpg"],
+    [b"\x89PNG\r\n\x1a\n", "png"],
+    [b"GIF87a", "gif"],
+    [b"GIF89a", "gif"],
+    [b"RIFF", "webp"],  # Followed by 4-byte size and b"WEBP".
+];
+MEDIA_NAME_RE = r"^([0-9a-f]{64})(?:-w(\d+))?\.(jpg|png|gif|webp)$";
+MEDIA_URL_RE = r"/_media/([0-9a-f]{64})\.(jpg|png|gif|webp)";
+
+def getMediaPath (mediaDir, name):
+    "Returns disk path for media (or variant) filename `name`.";
+    return os.path.join(mediaDir, name[:2], name);
+
+def getVariantName (sha, ext, width):
+    return "%s-w%s.%s" % (sha, width, ext);
+
+def buildSrcset (mediaDir, sha, ext):
+    "Returns `srcset` attr value for media `<sha>.<ext>`, w/ existing variants.";
+    # Variants narrower than the original only, and only w/ Pillow.
+    nameList = [getVariantName(sha, ext, width) for width in VARIANT_WIDTHS];
+    return ", ".join(
+        "/_media/%s %sw" % (name, width)
+        for (name, width) in zip(nameList, VARIANT_WIDTHS)
+        if os.path.isfile(getMediaPath(mediaDir, name))
+    );
+
+def sniffExt (headBytes):
+    "Returns extension implied by file's leading bytes, else None.";
+    for (magic, ext) in MAGIC_EXT_LIST:
+        if headBytes.startswith(magic):
+            if ext == "webp" and headBytes[8:12] != b"WEBP":
+                continue;
+            return ext;
+    return None;
+
+def storeStream (mediaDir, fileLike, contentLength, ext):
+    "Streams `contentLength` bytes from `fileLike` to disk. Returns sha256.";
+    tmpDir = os.path.join(mediaDir, "tmp");
+    os.makedirs(tmpDir, exist_ok=True);
+    hasher = hashlib.sha256();
+    remaining = contentLength;
+    with tempfile.NamedTemporaryFile(dir=tmpDir, delete=False) as tmpFile:
+        try:
+            while remaining > 0:
+                chunk = fileLike.read(min(CHUNK_SIZE, remaining));
+                if not chunk:
+                    raise ValueError("Upload ended prematurely.");
+                if remaining == contentLength and sniffExt(chunk) != ext:
+                    raise ValueError("File contents don't match its type.");
+                hasher.update(chunk);
+                tmpFile.write(chunk);
+                remaining -= len(chunk);
+        except:
+            os.remove(tmpFile.name);
+            raise;
+    sha = hasher.hexdigest();
+    path = getMediaPath(mediaDir, "%s.%s" % (sha, ext));
+    os.makedirs(os.path.dirname(path), exist_ok=True);
+    os.replace(tmpFile.name, path);     # Atomic; idempotent for same sha.
+    return sha;
+
+def generateVariants (mediaDir, sha, ext):
+    "Generates resized variants. Returns [width, height, variantWidthList].";
+    try:
+        from PIL import Image;
+    except ImportError:
+        print("ViloLog: Install Pillow to enable resized image variants.");
+        return [None, None, []];
+    path = getMediaPath(mediaDir, "%s.%s" % (sha, ext));
+    variantWidthList = [];
+    with Image.open(path) as img:
+        width, height = img.size;
+        if ext == "gif":
+            return [width, height, []];     # Don't flatten animations.
+        for variantWidth in VARIANT_WIDTHS:
+            if variantWidth >= width:
+                break;
+            variantHeight = max(1, round(height * variantWidth / width));
+            variant = img.resize((variantWidth, variantHeight), Image.LANCZOS);
+            if ext == "jpg" and variant.mode != "RGB":
+                variant = variant.convert("RGB");
+            saveOpts = {
+                "jpg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+                "png": {"format": "PNG", "optimize": True},
+                "webp": {"format": "WEBP", "quality": 80},
+            }[ext];
+            variantPath = getMediaPath(mediaDir, getVariantName(sha, ext, variantWidth));
+            tmpPath = variantPath + ".tmp";
+            variant.save(tmpPath, **saveOpts);
+            os.replace(tmpPath, variantPath);
+            variantWidthList.append(variantWidth);
+    return [width, height, variantWidthList];
+
+def validateMedia (media, blogId):
+    assert type(media) in [dict, dotsi.Dict];
+    media = dotsi.fy(media);
+    assert media._id and type(media._id) is str;
+    assert type(media.blogId) is str and media.blogId == blogId;
+    assert media.version == MEDIA_VERSION;
+    assert media.type == "media";
+    assert re.match(r"^[0-9a-f]{64}$", media.sha);
+    assert media.ext in MIME_EXT_MAP.values();
+    assert type(media.size) is int and media.size > 0;
+    assert media.status in ["processing", "ready"];
+    assert media.uploaderId and type(media.uploaderId) is str;
+    assert media.createdAt and type(media.createdAt) is int;
+    return True;
+
+def buildMedia (sha, ext, size, filename, uploader, blogId):
+    media = dotsi.fy({
+        "_id": utils.genId(),
+        "blogId": blogId,
+        "version": MEDIA_VERSION,
+        "type": "media",
+        "sha": sha,
+        "ext": ext,
+        "size": size,
+        "filename": filename,
+        "width": None,
+        "height": None,
+        "variantWidths": [],
+        "status": "processing",
+        "uploaderId": uploader._id,
+        "createdAt": utils.getNow(),
+    });
+    assert validateMedia(media, blogId);
+    return media;
+
+def insertMedia (db, media, blogId):
+    assert validateMedia(media, blogId);
+    db.insertOne(media);
+
+def replaceMedia (db, media, blogId):
+    assert validateMedia(media, blogId);
+    db.replaceOne(media);
+
+def getMedia (db, subdoc, blogId):
+    if type(subdoc) is str:
+        subdoc = {"_id": subdoc};
+    subdoc.update({"type": "media", "blogId": blogId});
+    return db.findOne(subdoc);
+
+def getMediaBySha (db, sha, blogId):
+    return getMedia(db, {"sha": sha}, blogId);
+
+def getMediaListBySha (db, sha):
+    "Returns media (across blogs) with `sha`, as they share files on disk.";
+    return db.find({"type": "media", "sha": sha});
+
+def getRecentMediaList (db, blogId, limit=100):
+    return db.find({"type": "media", "blogId": blogId}, whereEtc="""
+        ORDER BY (doc->>'createdAt')::int DESC
+    """, limit=limit);
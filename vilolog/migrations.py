@@ -0,0 +1,145 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+import json;
+import time;
+
+import pogodb;
+import psycopg2;
+import psycopg2.extras;
+
+from . import dbPool;
+
+# Docs carry a `version`. Each model keeps a map from version `v`
+# to an upgrader that turns a v-doc into a (v+1)-doc, in place.
+# Docs are upgraded lazily, upon being read, and are written back.
+# Write-backs are conditional on the stored version, so they never
+# clobber a concurrent save. The background migrator upgrades the
+# rest, in small committed batches, and can be re-run (resumed) at
+# any time, as it only ever looks for old-version docs.
+
+def createIndexes (pgUrl, indexList, verbose=True):
+    "Builds missing indexes, w/o blocking writes. Returns names built.";
+    # CREATE INDEX CONCURRENTLY can't run in a transaction, hence
+    # autocommit. An interrupted build leaves an invalid index behind,
+    # which IF NOT EXISTS would skip; such indexes are rebuilt.
+    with pogodb.connect(pgUrl):
+        pass;   # Ensures that pogotbl exists.
+    con = psycopg2.connect(pgUrl);
+    con.autocommit = True;
+    builtList = [];
+    try:
+        cur = con.cursor();
+        for (name, definition) in indexList:
+            cur.execute("""
+                SELECT i.indisvalid FROM pg_index AS i
+                JOIN pg_class AS c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND pg_table_is_visible(c.oid);
+            """, [name]);
+            row = cur.fetchone();
+            if row and row[0]:
+                continue;   # Exists, and is valid.
+            if row:
+                cur.execute("DROP INDEX CONCURRENTLY %s;" % name);
+            if verbose:
+                print("ViloLog: Building index %s ..." % name);
+            cur.execute("CREATE INDEX CONCURRENTLY %s %s;" % (name, definition));
+            builtList.append(name);
+    finally:
+        con.close();
+    return builtList;
+
+def upgradeDoc (doc, upgraderMap, latestVersion):
+    "Upgrades `doc` in place, one version at a time. Returns True if upgraded.";
+    assert type(doc.version) is int and doc.version <= latestVersion;
+    # ^ Docs newer than `latestVersion` can't be handled by this code.
+    upgraded = False;
+    while doc.version < latestVersion:
+        version = doc.version;
+        upgraderMap[version](doc);
+        assert doc.version == version + 1;
+        upgraded = True;
+    return upgraded;
+
+def writeBack (db, doc, oldVersion):
+    "Writes upgraded `doc`, unless stored doc isn't at `oldVersion`. Returns 1 or 0.";
+    db._execute("""
+        UPDATE pogotbl SET doc = %s
+        WHERE doc->'_id' = to_jsonb(%s::text)
+        AND doc->'version' = to_jsonb(%s::int);
+    """, [json.dumps(doc), doc._id, oldVersion]);
+    return db._cur.rowcount;
+
+def adaptDoc (db, doc, upgraderMap, latestVersion):
+    "Upgrades `doc` if it's old, and writes it back. Returns `doc`.";
+    oldVersion = doc.version;
+    if upgradeDoc(doc, upgraderMap, latestVersion):
+        writeBack(db, doc, oldVersion);
+    return doc;
+
+def migrateDocs (pgUrl, docType, upgraderMap, latestVersion,
+        batchSize=100, pauseSecs=0.1, verbose=True,
+    ):
+    "Upgrades all old-version docs of `docType`. Returns count upgraded.";
+    # Old docs are streamed via a server-side cursor, on one
+    # connection, while upgrades are committed per batch, on another.
+    # Thus, locks are only ever held for the duration of one batch.
+    readCon = psycopg2.connect(pgUrl);
+    writeCon = psycopg2.connect(pgUrl);
+    count = 0;
+    def writeBatch (docList):
+        with writeCon:  # Commits batch.
+            writeCur = writeCon.cursor(
+                cursor_factory=psycopg2.extras.RealDictCursor,
+            );
+            db = pogodb.bindConCur(writeCon, writeCur, skipSetup=True);
+            n = 0;
+            for doc in docList:
+                oldVersion = doc.version;
+                upgradeDoc(doc, upgraderMap, latestVersion);
+                n += writeBack(db, doc, oldVersion);
+            return n;
+    try:
+        readDb = pogodb.bindConCur(readCon, readCon.cursor(), skipSetup=True);
+        rowIter = dbPool.iterSql(readDb, """
+            SELECT doc FROM pogotbl
+            WHERE doc->>'type' = %s AND (doc->>'version')::int < %s;
+        """, [docType, latestVersion], fetchSize=batchSize);
+        docList = [];
+        for row in rowIter:
+            docList.append(row.doc);
+            if len(docList) < batchSize:
+                continue;
+            count += writeBatch(docList);
+            docList = [];
+            if verbose:
+                print("ViloLog: Migrated %s %s docs ..." % (count, docType));
+            time.sleep(pauseSecs);  # Throttle, yielding to live traffic.
+        count += writeBatch(docList);
+    finally:
+        readCon.close();
+        writeCon.close();
+    return count;
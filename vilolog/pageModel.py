@@ -25,13 +25,48 @@ trademarks, service marks, brand names or logos of Polydojo, Inc.
 """;
 
 import re;
+import json;
+import calendar;
+import time;
 
 import dotsi;
 
 from . import utils;
+from . import markup;
+from . import migrations;
+from . import dbPool;
+from . import records;
 
 
-PAGE_VERSION = 0;
+PAGE_VERSION = 1;
+PAGE_STUB_LIMIT = 20;   # Default page-size for keyset-paginated lists.
+TAG_RE = r"^[a-z0-9][a-z0-9_-]*$";
+TAG_LIMIT = 20;         # Max tags per page.
+PUBLISH_AT_RE = r"^\d\d\d\d-\d\d-\d\dT\d\d:\d\d:\d\dZ$";    # UTC, ISO 8601.
+
+# Indexes backing tag, date- and title-ordered page queries, as
+# (name, definition) pairs. Built by `migrations.createIndexes(.)`.
+PAGE_INDEX_LIST = [
+    ("vilolog_page_tags", """ON pogotbl
+        USING GIN ((doc->'meta'->'tags'))
+        WHERE doc->>'type' = 'page'
+    """),
+    ("vilolog_page_isodate", """ON pogotbl (
+            (doc->>'blogId'), (doc->'meta'->>'isoDate'), (doc->>'_id')
+        ) WHERE doc->>'type' = 'page'
+    """),
+    ("vilolog_page_title", """ON pogotbl (
+            (doc->>'blogId'), lower(doc->'meta'->>'title'), (doc->>'_id')
+        ) WHERE doc->>'type' = 'page'
+    """),
+];
+
+def validateTags (tags):
+    assert type(tags) is dotsi.List and len(tags) <= TAG_LIMIT;
+    for tag in tags:
+        assert type(tag) is str and re.match(TAG_RE, tag);
+    assert len(set(tags)) == len(tags);
+    return True;
 
 def validateMeta (meta):
     assert type(meta) is dotsi.Dict;
@@ -43,6 +78,12 @@ def validateMeta (meta):
     assert meta.template and type(meta.template) is str;
     assert meta.template.endswith(".html");
     assert type(meta.isDraft) is bool;
+    if "tags" in meta:
+        assert validateTags(meta.tags);
+    if "publishAt" in meta:
+        assert type(meta.publishAt) is str;
+        assert re.match(PUBLISH_AT_RE, meta.publishAt);
+        assert parsePublishAt(meta.publishAt);  # Raises if invalid date.
     return True;
 
 def validatePage (page, blogId):
@@ -57,8 +98,16 @@ def validatePage (page, blogId):
     assert page.body and type(page.body) is str;
     assert page.authorId and type(page.authorId) is str;
     assert page.createdAt and type(page.createdAt) is int;
+    assert type(page.derived) is dotsi.Dict;
+    assert type(page.derived.wordCount) is int;
+    assert type(page.derived.toc) is dotsi.List;
     return True;
 
+def refreshDerived (page):
+    "Recomputes `page.derived`, i.e. excerpt, TOC, etc., from `page.body`.";
+    page.derived = dotsi.fy(markup.computeDerived(page.body));
+    return page;
+
 def buildPage (meta, body, author, blogId):
     page = dotsi.fy({
         "_id": utils.genId(),
@@ -70,24 +119,63 @@ def buildPage (meta, body, author, blogId):
         "authorId": author._id,
         "createdAt": utils.getNow(),
     });
+    refreshDerived(page);
     assert validatePage(page, blogId);
     return page;
 
+def parsePublishAt (publishAt):
+    "Parses `publishAt`, like '2020-10-31T09:30:00Z', to seconds since epoch.";
+    return calendar.timegm(time.strptime(publishAt, "%Y-%m-%dT%H:%M:%SZ"));
+
+def applyPublishAt (page):
+    "Forces a page scheduled for later to be a draft. Returns secs till then.";
+    if not page.meta.get("publishAt"):
+        return 0;   # Not scheduled.
+    delaySecs = parsePublishAt(page.meta.publishAt) - utils.getNow();
+    if delaySecs <= 0:
+        return 0;   # Already due.
+    page.meta.isDraft = True;
+    return delaySecs;
+
+# Page writes keep per-blog stats up to date, incrementally. Each
+# write locks the blog's stats doc first, so concurrent writes to
+# the same blog apply their deltas one at a time, each computed
+# against the page's latest committed version.
+
 def insertPage (db, page, blogId):
     assert validatePage(page, blogId);
+    stats = lockPageStats(db, blogId);
     db.insertOne(page);
+    updatePageStats(db, stats, None, page);
 
 def replacePage(db, page, blogId):
+    refreshDerived(page);
     assert validatePage(page, blogId);
+    stats = lockPageStats(db, blogId);
+    oldPage = db.findById(page._id);
     db.replaceOne(page);
+    updatePageStats(db, stats, oldPage, page);
 
 def deletePage (db, page, blogId):
     assert validatePage(page, blogId);
+    stats = lockPageStats(db, blogId);
+    oldPage = db.findById(page._id);
     db.deleteOne(page._id);
+    updatePageStats(db, stats, oldPage, None);
+
+def _upgradePage_v0 (page):
+    "v0 -> v1: Adds `derived`.";
+    refreshDerived(page);
+    page.version = 1;
+
+PAGE_UPGRADER_MAP = {
+    # fromVersion: upgrader
+    0: _upgradePage_v0,
+};
 
 def adaptPage (db, page):
-    assert page.version == PAGE_VERSION;
-    return page;
+    "Upgrades `page` (lazily, upon read) to PAGE_VERSION.";
+    return migrations.adaptDoc(db, page, PAGE_UPGRADER_MAP, PAGE_VERSION);
 
 def getPage (db, subdoc, blogId, whereEtc="", argsEtc=None):
     if type(subdoc) is str:
@@ -141,12 +229,212 @@ def getPageList (db, subdoc, blogId, whereEtc="", argsEtc=None):
     # Finally:
     return pageList;
 
+def iterPages (db, subdoc, blogId, whereEtc="", argsEtc=None,
+        fetchSize=dbPool.ITER_FETCH_SIZE, stubsOnly=False,
+    ):
+    "Yields pages one by one, streamed via a server-side cursor.";
+    # Stubs (i.e. body-less pages) are yielded as-is, un-adapted.
+    subdoc.update({"type": "page", "blogId": blogId});
+    stmt = "SELECT {docExpr} AS doc FROM pogotbl WHERE doc @> %s {etc};".format(
+        docExpr=("doc - 'body'" if stubsOnly else "doc"), etc=whereEtc,
+    );
+    args = [json.dumps(subdoc)] + (argsEtc or []);
+    for row in dbPool.iterSql(db, stmt, args, fetchSize):
+        yield (row.doc if stubsOnly else adaptPage(db, row.doc));
+
 def getAllPages_inclDrafts (db, blogId):
     return getPageList(db, {}, blogId);
 
 def getAllPages_exclDrafts (db, blogId):
     return getPageList(db, {"meta": {"isDraft": False}}, blogId);
 
+def backfillDerived (db, blogId):
+    "Recomputes `.derived` for all pages, incl. drafts.";
+    count = 0;
+    for page in iterPages(db, {}, blogId):
+        refreshDerived(page);
+        db.replaceOne(page);
+        count += 1;
+    return count;
+
+PAGE_SORT_EXPR_MAP = {
+    "isoDate": "doc->'meta'->>'isoDate'",
+    "title": "lower(doc->'meta'->>'title')",
+};
+
+def getPageStubs (db, blogId, filterSql="", filterArgs=None,
+        exclDrafts=True, after=None, limit=None,
+        sortBy="isoDate", ascending=False, asRecords=False,
+    ):
+    "Returns [stubList, nextAfter]. Stubs are body-less pages.";
+    # Keyset pagination: `after` is the (sortKey, _id) pair of the last
+    # stub on the previous page, as returned via `nextAfter`.
+    # With `asRecords`, stubs are read-only PageRecords, not dotsi dicts.
+    limit = limit or PAGE_STUB_LIMIT;
+    sortExpr = PAGE_SORT_EXPR_MAP[sortBy];
+    condList = ["doc->>'type' = 'page'", "doc->>'blogId' = %s"];
+    args = [blogId];
+    if exclDrafts:
+        condList.append("doc->'meta'->'isDraft' = 'false'::jsonb");
+    if filterSql:
+        condList.append(filterSql);
+        args.extend(filterArgs or []);
+    if after:
+        condList.append("({sortExpr}, doc->>'_id') {op} (%s, %s)".format(
+            sortExpr=sortExpr, op=(">" if ascending else "<"),
+        ));
+        args.extend(after);
+    stmt = """
+        SELECT doc - 'body' AS doc, {sortExpr} AS "sortKey"
+        FROM pogotbl WHERE {conds}
+        ORDER BY {sortExpr} {dir}, doc->>'_id' {dir}
+        LIMIT %s;
+    """.format(
+        sortExpr=sortExpr, conds=" AND ".join(condList),
+        dir=("ASC" if ascending else "DESC"),
+    );
+    db._cur.execute(stmt, args + [limit + 1]);
+    rowList = db._cur.fetchall();   # Raw rows, not (yet) dotsi-fied.
+    wrap = records.PageRecord if asRecords else dotsi.fy;
+    stubList = utils.mapli(rowList[ : limit], lambda row: wrap(row["doc"]));
+    if len(rowList) <= limit:
+        return [stubList, None];
+    lastRow = rowList[limit - 1];
+    return [stubList, [lastRow["sortKey"], lastRow["doc"]["_id"]]];
+
+def getPageStubsByTag (db, tag, blogId, before=None, asRecords=False):
+    return getPageStubs(db, blogId,
+        "doc->'meta'->'tags' @> %s::jsonb", [json.dumps([tag])],
+        after=before, asRecords=asRecords,
+    );
+
+def getPageStubsByDatePrefix (db, datePrefix, blogId, before=None,
+        asRecords=False,
+    ):
+    "Datewise archive. `datePrefix` is like 'YYYY' or 'YYYY-MM'.";
+    return getPageStubs(db, blogId,
+        "doc->'meta'->>'isoDate' >= %s AND doc->'meta'->>'isoDate' < %s",
+        [datePrefix, datePrefix + "~"],  # '~' sorts after digits and '-'.
+        after=before, asRecords=asRecords,
+    );
+
+def getAdminPageStubs (db, blogId, status="", authorId="", template="",
+        titlePrefix="", sortBy="isoDate", ascending=False, after=None,
+    ):
+    "Returns [stubList, nextAfter], for the admin's filterable page-lister.";
+    condList, args = [], [];
+    if status == "draft":
+        condList.append("doc->'meta'->'isDraft' = 'true'::jsonb");
+    elif status == "published":
+        condList.append("doc->'meta'->'isDraft' = 'false'::jsonb");
+    if authorId:
+        condList.append("doc->>'authorId' = %s");
+        args.append(authorId);
+    if template:
+        condList.append("doc->'meta'->>'template' = %s");
+        args.append(template);
+    if titlePrefix:
+        likeSafe = re.sub(r"([\\%_])", r"\\\1", titlePrefix);
+        condList.append("lower(doc->'meta'->>'title') LIKE lower(%s)");
+        args.append(likeSafe + "%");
+    return getPageStubs(db, blogId, " AND ".join(condList), args,
+        exclDrafts=False, after=after, sortBy=sortBy, ascending=ascending,
+    );
+
+def getPageStatsId (blogId):
+    return "pageStats:" + blogId;
+
+def refreshPageStats (db, blogId):
+    "Recomputes per-blog page stats from scratch. For backfill or repair.";
+    rowList = db._execute("""
+        SELECT tag, COUNT(*) AS n FROM pogotbl,
+            jsonb_array_elements_text(doc->'meta'->'tags') AS tag
+        WHERE doc->>'type' = 'page' AND doc->>'blogId' = %s
+            AND doc->'meta'->'isDraft' = 'false'::jsonb
+            AND jsonb_typeof(doc->'meta'->'tags') = 'array'
+        GROUP BY tag ORDER BY n DESC, tag COLLATE "C" ASC;
+    """, [blogId], fetch="all");
+    countRow = db._execute("""
+        SELECT COUNT(*) AS total,
+            COUNT(*) FILTER (
+                WHERE doc->'meta'->'isDraft' = 'true'::jsonb
+            ) AS drafts
+        FROM pogotbl WHERE doc->>'type' = 'page' AND doc->>'blogId' = %s;
+    """, [blogId], fetch="one");
+    templateRowList = db._execute("""
+        SELECT doc->'meta'->>'template' COLLATE "C" AS template, COUNT(*) AS n
+        FROM pogotbl WHERE doc->>'type' = 'page' AND doc->>'blogId' = %s
+        GROUP BY template ORDER BY template ASC;
+    """, [blogId], fetch="all");
+    stats = dotsi.fy({
+        "_id": getPageStatsId(blogId),
+        "blogId": blogId,
+        "type": "pageStats",
+        "tagCounts": [[row.tag, row.n] for row in rowList],
+        "templateCounts": [[row.template, row.n] for row in templateRowList],
+        "pageCounts": {
+            "total": countRow.total,
+            "drafts": countRow.drafts,
+            "published": countRow.total - countRow.drafts,
+        },
+        "updatedAt": utils.getNow(),
+    });
+    storePageStats(db, stats);
+    return stats;
+
+def storePageStats (db, stats):
+    db._execute("""
+        INSERT INTO pogotbl (doc) VALUES (%s)
+        ON CONFLICT ((doc->'_id')) DO UPDATE SET doc = EXCLUDED.doc;
+    """, [json.dumps(stats)]);
+
+def lockPageStats (db, blogId):
+    "Returns page stats, locked till the end of the transaction.";
+    # An advisory lock (vs FOR UPDATE) also covers the missing-row case.
+    statsId = getPageStatsId(blogId);
+    db._execute("SELECT pg_advisory_xact_lock(hashtext(%s));", [statsId]);
+    rowList = db._execute("SELECT doc FROM pogotbl WHERE doc->'_id' = %s;", [
+        json.dumps(statsId),
+    ], fetch="all");
+    if rowList:
+        return dotsi.fy(rowList[0].doc);
+    return refreshPageStats(db, blogId);
+
+def updatePageStats (db, stats, oldPage, newPage):
+    "Applies the change from `oldPage` to `newPage` (either may be None).";
+    tagMap = dict(stats.tagCounts);
+    templateMap = dict(stats.templateCounts);
+    pageCounts = stats.pageCounts;
+    for (page, sign) in [(oldPage, -1), (newPage, 1)]:
+        if not page:
+            continue;
+        isDraft = page.meta.isDraft;
+        pageCounts.total += sign;
+        pageCounts["drafts" if isDraft else "published"] += sign;
+        template = page.meta.template;
+        templateMap[template] = templateMap.get(template, 0) + sign;
+        for tag in ([] if isDraft else page.meta.get("tags") or []):
+            tagMap[tag] = tagMap.get(tag, 0) + sign;
+    # Same order as in refreshPageStats(.):
+    stats.tagCounts = sorted(
+        [[tag, n] for (tag, n) in tagMap.items() if n],
+        key=lambda pair: (-pair[1], pair[0]),
+    );
+    stats.templateCounts = sorted(
+        [[template, n] for (template, n) in templateMap.items() if n],
+    );
+    stats.updatedAt = utils.getNow();
+    storePageStats(db, stats);
+
+def getPageStats (db, blogId):
+    "Returns cached page stats, computing (& storing) them if missing.";
+    stats = db.findById(getPageStatsId(blogId));
+    return stats or refreshPageStats(db, blogId);
+    # ^ Missing for blogs created before stats, until their first write.
+
 def deleteAllPages (db, blogId):
-    for page in getAllPages_inclDrafts(db, blogId):
-        db.deleteOne(page._id);
+    lockPageStats(db, blogId);
+    db._execute("DELETE FROM pogotbl WHERE doc @> %s;", [
+        json.dumps({"type": "page", "blogId": blogId}),
+    ]);
+    refreshPageStats(db, blogId);   # Cheap, as the blog has no pages.
@@ -0,0 +1,140 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+# Read-only records, for hot public paths (like page listings).
+# Unlike dotsi.fy(.), which copies each (nested) dict into an
+# attribute-dict, records store known fields in __slots__, and
+# only the rare unknown keys in a small `_extra` dict. Records
+# support the access patterns that themes use: `page.meta.slug`,
+# `page.get("derived")`, `page.meta.get("excerpt")`, etc., as well
+# as dict-style iteration via `keys()`, `items()`, `for k in rec`.
+# Records aren't dicts though, so `json.dumps(.)` needs `.toDict()`.
+# Mutation flows (editing, upgrading, etc.) still use dotsi dicts.
+
+class Record (object):
+    "Base class for immutable, slotted records.";
+    __slots__ = ("_extra",);
+    _fields = ();
+    _fieldSet = frozenset();
+    _nestedMap = {};    # field -> callable, for wrapping nested values.
+
+    def __init__ (self, doc):
+        setField = object.__setattr__;
+        fieldSet = self._fieldSet;
+        nestedMap = self._nestedMap;
+        extra = None;
+        for (key, value) in doc.items():
+            if key in nestedMap and value is not None:
+                value = nestedMap[key](value);
+            if key in fieldSet:
+                setField(self, key, value);
+            else:
+                extra = extra or {};
+                extra[key] = value;
+        setField(self, "_extra", extra);
+
+    def __getattr__ (self, key):
+        # Called only if regular (slot) lookup fails.
+        extra = object.__getattribute__(self, "_extra");
+        if extra and key in extra:
+            return extra[key];
+        raise AttributeError(key);
+
+    def __setattr__ (self, key, value):
+        raise AttributeError("Records are read-only.");
+
+    def __getitem__ (self, key):
+        try:
+            return getattr(self, key);
+        except AttributeError:
+            raise KeyError(key);
+
+    def __contains__ (self, key):
+        return self.get(key, self) is not self;
+
+    def get (self, key, default=None):
+        try:
+            return getattr(self, key);
+        except AttributeError:
+            return default;
+
+    def keys (self):
+        keyList = [k for k in self._fields if hasattr(self, k)];
+        return keyList + list(self._extra or {});
+
+    def __iter__ (self):
+        return iter(self.keys());
+
+    def __len__ (self):
+        return len(self.keys());
+
+    def __bool__ (self):
+        # Cheaper than __len__, for the common `rec.get(..) or {}`.
+        return bool(self._extra) or any(
+            hasattr(self, k) for k in self._fields
+        );
+
+    def values (self):
+        return [self[k] for k in self.keys()];
+
+    def items (self):
+        return [(k, self[k]) for k in self.keys()];
+
+    def toDict (self):
+        "Returns a plain (deep) dict copy.";
+        unwrap = lambda v: v.toDict() if isinstance(v, Record) else (
+            [unwrap(x) for x in v] if type(v) is tuple else v
+        );
+        return {k: unwrap(self[k]) for k in self.keys()};
+
+    def __repr__ (self):
+        return "%s(%r)" % (type(self).__name__, self.toDict());
+
+class TocItemRecord (Record):
+    _fields = ("level", "text", "anchor");
+    __slots__ = _fields;
+    _fieldSet = frozenset(_fields);
+
+class DerivedRecord (Record):
+    _fields = ("excerpt", "wordCount", "readingMins", "toc", "firstImage");
+    __slots__ = _fields;
+    _fieldSet = frozenset(_fields);
+    _nestedMap = {"toc": lambda toc: tuple(map(TocItemRecord, toc))};
+
+class MetaRecord (Record):
+    _fields = ("title", "slug", "isoDate", "template", "isDraft", "tags");
+    __slots__ = _fields;
+    _fieldSet = frozenset(_fields);
+    _nestedMap = {"tags": tuple};
+
+class PageRecord (Record):
+    _fields = (
+        "_id", "blogId", "version", "type", "meta", "body",
+        "authorId", "createdAt", "derived",
+    );
+    __slots__ = _fields;
+    _fieldSet = frozenset(_fields);
+    _nestedMap = {"meta": MetaRecord, "derived": DerivedRecord};
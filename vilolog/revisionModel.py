@@ -0,0 +1,154 @@
+"""
+ViloLog: Simple blogging engine, built atop Vilo and PogoDB.
+
+Copyright (c) 2020 Polydojo, Inc.
+
+SOFTWARE LICENSING
+------------------
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+NO TRADEMARK RIGHTS
+-------------------
+The above software licensing terms DO NOT grant any right in the
+trademarks, service marks, brand names or logos of Polydojo, Inc.
+""";
+
+import json;
+import difflib;
+
+import dotsi;
+
+from . import utils;
+
+# Revisions live in a dedicated table, away from pogotbl, so that
+# page queries never scan them. Each revision stores the full
+# meta, but the body is stored as a line-based delta against the
+# previous revision, except every SNAPSHOT_INTERVAL-th revision,
+# which stores the full body. Reconstruction thus applies at most
+# SNAPSHOT_INTERVAL - 1 deltas.
+
+REVISION_VERSION = 0;
+SNAPSHOT_INTERVAL = 10;
+
+def ensureTable (db):
+    db._execute("""
+        CREATE TABLE IF NOT EXISTS vilolog_revision (
+            page_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            doc JSONB NOT NULL,
+            PRIMARY KEY (page_id, seq)
+        );
+    """);
+
+def computeDelta (oldBody, newBody):
+    "Returns list of [i1, i2, newLines], for replacing oldLines[i1:i2].";
+    oldLines = oldBody.splitlines(True);
+    newLines = newBody.splitlines(True);
+    matcher = difflib.SequenceMatcher(None, oldLines, newLines, autojunk=False);
+    return [
+        [i1, i2, newLines[j1 : j2]]
+        for (tag, i1, i2, j1, j2) in matcher.get_opcodes()
+        if tag != "equal"
+    ];
+
+def applyDelta (oldBody, delta):
+    oldLines = oldBody.splitlines(True);
+    newLines = [];
+    pos = 0;
+    for (i1, i2, lines) in delta:
+        newLines.extend(oldLines[pos : i1]);
+        newLines.extend(lines);
+        pos = i2;
+    newLines.extend(oldLines[pos : ]);
+    return "".join(newLines);
+
+def getRevision (db, pageId, seq):
+    "Returns revision `seq` of page `pageId`, with `.body` reconstructed.";
+    rowList = db._execute("""
+        SELECT doc FROM vilolog_revision
+        WHERE page_id = %(pageId)s AND seq <= %(seq)s AND seq >= (
+            SELECT MAX(seq) FROM vilolog_revision
+            WHERE page_id = %(pageId)s AND seq <= %(seq)s
+                AND doc->'isSnapshot' = 'true'::jsonb
+        )
+        ORDER BY seq ASC;
+    """, {"pageId": pageId, "seq": seq}, fetch="all");
+    if not rowList or rowList[-1].doc.seq != seq:
+        return None;
+    body = None;
+    for row in rowList:
+        if row.doc.isSnapshot:
+            body = row.doc.body;
+        else:
+            body = applyDelta(body, row.doc.delta);
+    revision = rowList[-1].doc;
+    revision.pop("delta", None);
+    revision.body = body;
+    return revision;
+
+def getLatestSeq (db, pageId):
+    row = db._execute("""
+        SELECT MAX(seq) AS seq FROM vilolog_revision WHERE page_id = %s;
+    """, [pageId], fetch="one");
+    return row.seq;     # None if no revisions.
+
+def recordRevision (db, page, editorId, blogId):
+    "Records `page`'s current meta and body as a new revision.";
+    db._execute("SELECT pg_advisory_xact_lock(hashtext(%s));", [page._id]);
+    # ^ Serializes concurrent saves of the same page, till commit.
+    lastSeq = getLatestSeq(db, page._id);
+    lastRevision = None if lastSeq is None else getRevision(db, page._id, lastSeq);
+    if lastRevision and (
+        lastRevision.body == page.body and lastRevision.meta == page.meta
+    ):
+        return lastRevision;    # No change, skip.
+    seq = 0 if lastSeq is None else lastSeq + 1;
+    revision = dotsi.fy({
+        "pageId": page._id,
+        "blogId": blogId,
+        "version": REVISION_VERSION,
+        "seq": seq,
+        "meta": page.meta,
+        "editorId": editorId,
+        "createdAt": utils.getNow(),
+        "isSnapshot": (seq % SNAPSHOT_INTERVAL == 0),
+    });
+    if revision.isSnapshot:
+        revision.body = page.body;
+    else:
+        revision.delta = computeDelta(lastRevision.body, page.body);
+    db._execute("""
+        INSERT INTO vilolog_revision (page_id, seq, doc) VALUES (%s, %s, %s);
+    """, [page._id, seq, json.dumps(revision)]);
+    return revision;
+
+def getRevisionSummaryList (db, pageId):
+    "Returns summaries (sans body/delta) of `pageId`'s revisions, newest 1st.";
+    rowList = db._execute("""
+        SELECT seq, doc - 'body' - 'delta' AS doc,
+            octet_length(doc::text) AS "storedBytes"
+        FROM vilolog_revision WHERE page_id = %s
+        ORDER BY seq DESC;
+    """, [pageId], fetch="all");
+    return utils.mapli(rowList,
+        lambda row: dotsi.fy(dict(row.doc, storedBytes=row.storedBytes)),
+    );
+
+def deleteRevisions (db, pageId):
+    db._execute("DELETE FROM vilolog_revision WHERE page_id = %s;", [pageId]);
+
+def deleteAllRevisions (db, blogId):
+    db._execute("""
+        DELETE FROM vilolog_revision WHERE doc->>'blogId' = %s;
+    """, [blogId]);
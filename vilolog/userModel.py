@@ -25,10 +25,12 @@ trademarks, service marks, brand names or logos of Polydojo, Inc.
 """;
 
 import re;
+import json;
 
 import dotsi;
 
 from . import utils;
+from . import migrations;
 
 USER_VERSION = 0;
 
@@ -47,7 +49,7 @@ def validateUser (user, blogId):
     assert user.role in ["admin", "author", "deactivated"];
     return True;
 
-def buildUser (name, email, password, role, blogId):
+def buildUser (name, email, password, role, blogId, hashPw=utils.hashPw):
     user = dotsi.fy({
         "_id": utils.genId(),
         "blogId": blogId,
@@ -55,7 +57,7 @@ def buildUser (name, email, password, role, blogId):
         "type": "user",
         "name": name,
         "email": email,
-        "hpw": utils.hashPw(password),
+        "hpw": hashPw(password),
         "createdAt": utils.getNow(),
         "role": role,
         #TODO: "bio": "bio",
@@ -75,9 +77,14 @@ def replaceUser(db, user, blogId):
 #    assert validateUser(user, blogId);
 #    db.deleteOne(user._id);
 
+USER_UPGRADER_MAP = {
+    # fromVersion: upgrader, like `0: _upgradeUser_v0`,
+    # where each upgrader also bumps `user.version`.
+};
+
 def adaptUser (db, user):
-    assert user.version == USER_VERSION;
-    return user;
+    "Upgrades `user` (lazily, upon read) to USER_VERSION.";
+    return migrations.adaptDoc(db, user, USER_UPGRADER_MAP, USER_VERSION);
 
 def getUser (db, subdoc, blogId):
     if type(subdoc) is str:
@@ -102,5 +109,6 @@ def getAllUsers (db, blogId):
     return getUserList(db, {}, blogId);
 
 def deleteAllUsers (db, blogId):
-    for user in getAllUsers(db, blogId):
-        db.deleteOne(user._id);
+    db._execute("DELETE FROM pogotbl WHERE doc @> %s;", [
+        json.dumps({"type": "user", "blogId": blogId}),
+    ]);
@@ -26,8 +26,13 @@ trademarks, service marks, brand names or logos of Polydojo, Inc.
 
 import uuid;
 import time;
+import threading;
+import collections;
+import concurrent.futures;
 
-import bcrypt;
+import dotsi;
+
+BCRYPT_ROUNDS = 12; # Cost factor, matches bcrypt.gensalt()'s default.
 
 genId = lambda n=1: "".join(map(lambda i: uuid.uuid4().hex, range(n)));
 getNow = lambda: int(time.time());  # Seconds since epoch.
@@ -35,5 +40,92 @@ mapli = lambda seq, fn: list(map(fn, seq));
 filterli = lambda seq, fn: list(filter(fn, seq));
 _b = lambda s, e="utf8": s.encode(e) if type(s) is str else s;
 _s = lambda b, e="utf8": b.decode(e) if type(b) is bytes else b;
-hashPw = lambda p: _s(bcrypt.hashpw(_b(p), bcrypt.gensalt()));
-checkPw = lambda p, h: bcrypt.checkpw(_b(p), _b(h));
+
+def hashPw (p, r=BCRYPT_ROUNDS):
+    import bcrypt;  # Lazy, as only needed on admin paths.
+    return _s(bcrypt.hashpw(_b(p), bcrypt.gensalt(r)));
+
+def checkPw (p, h):
+    import bcrypt;  # Lazy, as only needed on admin paths.
+    return bcrypt.checkpw(_b(p), _b(h));
+
+getPwRounds = lambda h: int(h.split("$")[2]);   # "$2b$12$..." -> 12
+
+class PwQueueFullError (Exception):
+    "Raised when a pw-hasher's queue is full.";
+
+def mkPwHasher (rounds=BCRYPT_ROUNDS, workerCount=2, queueLimit=32):
+    "Makes a pw-hasher that runs bcrypt on a bounded worker pool.";
+    executor = concurrent.futures.ThreadPoolExecutor(
+        workerCount, thread_name_prefix="vilolog-bcrypt",
+    );
+    slots = threading.BoundedSemaphore(workerCount + queueLimit);
+    # ^ Each slot is either being worked on, or is queued.
+    lock = threading.Lock();
+    stats = dotsi.fy({"accepted": 0, "rejected": 0, "pending": 0});
+
+    def onDone (future):
+        slots.release();
+        with lock: stats.pending -= 1;
+
+    def run (fn, *args):
+        if not slots.acquire(blocking=False):
+            with lock: stats.rejected += 1;
+            raise PwQueueFullError("Too many pending bcrypt tasks.");
+        with lock:
+            stats.accepted += 1;
+            stats.pending += 1;
+        future = executor.submit(fn, *args);
+        future.add_done_callback(onDone);
+        return future.result();
+
+    hasher = dotsi.fy({"rounds": rounds, "stats": stats});
+    hasher.hashPw = lambda p: run(hashPw, p, rounds);
+    hasher.checkPw = lambda p, h: run(checkPw, p, h);
+    hasher.needsRehash = lambda h: getPwRounds(h) != rounds;
+    return hasher;
+
+def mkLruCache (maxWeight, weigh=None, ttl=None):
+    "Makes a thread-safe LRU cache, bounded by the total weight of values.";
+    weigh = weigh or (lambda value: 1);     # Default: bound by count.
+    lock = threading.Lock();
+    entryMap = collections.OrderedDict();   # key -> [value, weight, expiry]
+    stats = dotsi.fy({"weight": 0, "hits": 0, "misses": 0});
+
+    def lookup (key, default=None):
+        with lock:
+            entry = entryMap.get(key);
+            if entry and entry[2] and entry[2] < time.time():
+                entryMap.pop(key);
+                stats.weight -= entry[1];
+                entry = None;   # Expired.
+            if not entry:
+                stats.misses += 1;
+                return default;
+            entryMap.move_to_end(key);
+            stats.hits += 1;
+            return entry[0];
+
+    def store (key, value):
+        weight = weigh(value);
+        if weight > maxWeight:
+            return value;       # Too heavy to cache.
+        expiry = time.time() + ttl if ttl else None;
+        with lock:
+            if key in entryMap:
+                stats.weight -= entryMap.pop(key)[1];
+            entryMap[key] = [value, weight, expiry];
+            stats.weight += weight;
+            while stats.weight > maxWeight:
+                _, oldEntry = entryMap.popitem(last=False);
+                stats.weight -= oldEntry[1];
+        return value;
+
+    def reset ():
+        with lock:
+            entryMap.clear();
+            stats.weight = 0;
+
+    return dotsi.fy({
+        "lookup": lookup, "store": store, "reset": reset, "stats": stats,
+    });
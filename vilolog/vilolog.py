@@ -25,16 +25,19 @@ trademarks, service marks, brand names or logos of Polydojo, Inc.
 """;
 
 import os;
+import io;
 import uuid;
 import time;
 import re;
 import functools;
 import json;
+import difflib;
+import urllib.parse;
 import pprint;
 import traceback;
+import threading;
+import concurrent.futures;
 
-import bcrypt;
-import dateutil;
 
 import vilo;
 import dotsi;
@@ -44,6 +47,13 @@ import qree;
 from . import utils;
 from . import pageModel;
 from . import userModel;
+from . import dbPool;
+from . import loginThrottle;
+from . import markup;
+from . import revisionModel;
+from . import mediaModel;
+from . import jobModel;
+from . import migrations;
 
 __version__ = "0.0.7";  # Req'd by flit.
 
@@ -70,21 +80,43 @@ def validateThemeDir (themeDir, reqdFilenameList):
         raise ValueError("Theme `%s` doesn't include directory: static/" % themeName);
     return True;
 
-def mkRenderTpl (baseThemeDir, defaultData):
+def mkRenderTpl (baseThemeDir, defaultData, cacheTpls=True):
     "Returns a function that render from `baseThemeDir`.";
+    tplFnCache = {};    # path -> compiled template function
+    
+    def getTplFn (path):
+        tplFn = tplFnCache.get(path);
+        if not tplFn:
+            with open(path, "r") as f:
+                tplFn = qree.execEval(qree.quoteReplace(f.read()));
+            if cacheTpls:
+                tplFnCache[path] = tplFn;
+        return tplFn;
+    
     def renderTpl (filename, data=None):
         data = dotsi.defaults(dotsi.fy({}),
             data or {}, defaultData, {"renderTpl": renderTpl},
         );
         path = os.path.join(baseThemeDir, filename);
         try:
-            return qree.renderPath(path, data);
+            return getTplFn(path)(data);
         except IOError as e:
             # Note: Error may be caused by a nested tpl.
             print("\n" + traceback.format_exc() + "\n");
             raise errLine("ERROR: Template %s not found.",
                 e.filename,
             );
+    
+    def precompile ():
+        "Compiles (and caches) each template. Returns count.";
+        filenameList = sorted(filter(
+            lambda f: f.endswith(".html"), os.listdir(baseThemeDir),
+        ));
+        for filename in filenameList:
+            getTplFn(os.path.join(baseThemeDir, filename));
+        return len(filenameList);
+    
+    renderTpl.precompile = precompile;
     return renderTpl;
 
 def oneLine (sentence, seq=()):
@@ -180,6 +212,8 @@ def mkPlugin_disableRemoteLogin (blogTpl):
             return True;    # On localhost, always allowed.
         if path.startswith("/_blog_static/"):
             return True;    # Special path, always allowed.
+        if path.startswith("/_media/"):
+            return True;    # Uploaded media, always allowed.
         if not path.startswith("/_"):
             return True;    # Non-admin path, always allowed.
         # otherwise ...
@@ -201,6 +235,88 @@ def mkPlugin_disableRemoteLogin (blogTpl):
         return wrapper;
     return plugin_disableRemoteLogin;
 
+def getClientIp (req, trustedProxyCount=0):
+    "Returns client IP, accounting for `trustedProxyCount` reverse proxies.";
+    remoteAddr = req.getEnviron().get("REMOTE_ADDR") or "";
+    xForwardedFor = req.getHeader("X-Forwarded-For");
+    if not (trustedProxyCount and xForwardedFor):
+        return remoteAddr;  # W/o trusted proxies, XFF is client-controlled.
+    ipList = [ip.strip() for ip in xForwardedFor.split(",")];
+    return ipList[-min(trustedProxyCount, len(ipList))];
+    # ^ Each trusted proxy appends one entry. Earlier ones can be spoofed.
+
+def mkPlugin_throttleLogin (loginPath, throttle, dbful, trustedProxyCount=0):
+    "Makes plugin for throttling login attempts, before any bcrypt work.";
+    @dbful
+    def checkAllowed (req, db):
+        clientIp = getClientIp(req, trustedProxyCount);
+        return throttle.check(db, clientIp, req.fdata.get("email"));
+    def plugin_throttleLogin (fn):
+        @functools.wraps(fn)
+        def wrapper (req, res, *a, **ka):
+            isLoginAttempt = (
+                req.getVerb() == "POST" and req.getPathInfo() == loginPath
+            );
+            if isLoginAttempt and not checkAllowed(req):
+                raise vilo.error(oneLine("""Too many login attempts.
+                    Please wait a minute and then try again.
+                """), 429);
+            return fn(req, res, *a, **ka);
+        return wrapper;
+    return plugin_throttleLogin;
+
+############################################################
+# Edge Caching: ############################################
+############################################################
+
+PRIVATE_CACHE_CONTROL = "private, no-store";
+
+def checkPublicPath (path):
+    "Helper for checking if `path` is fit for shared (proxy) caching.";
+    if path.startswith("/_blog_static/"):
+        return True;    # Special path, public.
+    return not path.startswith("/_");   # Non-admin path.
+
+def mkPlugin_cacheControl (maxAge, staleSecs):
+    "Makes plugin for setting Cache-Control, private unless provably public.";
+    publicCacheControl = (
+        "public, max-age=%d, stale-while-revalidate=%d" % (maxAge, staleSecs)
+        if maxAge else "no-cache"
+    );
+    def checkPublic (req, res):
+        return (
+            req.getVerb() == "GET" and
+            res.statusLine.startswith("200") and
+            checkPublicPath(req.getPathInfo()) and
+            not req.getUnsignedCookie("userId") and     # Not logged in.
+            not res.cookieJar and   # Not setting cookies.
+            res.getHeader("Cache-Control") == PRIVATE_CACHE_CONTROL
+            # ^ Route hasn't set its own policy.
+        );
+    def plugin_cacheControl (fn):
+        @functools.wraps(fn)
+        def wrapper (req, res, *a, **ka):
+            res.setHeader("Cache-Control", PRIVATE_CACHE_CONTROL);
+            # ^ Default, also applies to errors raised by `fn`.
+            handlerOut = fn(req, res, *a, **ka);
+            if checkPublic(req, res):
+                res.setHeader("Cache-Control", publicCacheControl);
+            return handlerOut;
+        return wrapper;
+    return plugin_cacheControl;
+
+def mkHttpPurgeHook (url, method="PURGE", keyHeader="Surrogate-Key",
+        extraHeaders=None, timeout=10,
+    ):
+    "Makes a purge hook, which sends surrogate keys to a proxy via HTTP.";
+    import urllib.request;
+    def purgeHook (keyList):
+        headers = dict(extraHeaders or {}, **{keyHeader: " ".join(keyList)});
+        request = urllib.request.Request(url, method=method, headers=headers);
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status;     # Non-2xx raises HTTPError.
+    return purgeHook;
+
 ############################################################
 # Build: ###################################################
 ############################################################
@@ -221,6 +337,20 @@ def buildApp (
         disableRemoteLogin = False,
         remoteNetlocList = None,
         remoteHttpsOnly = False,
+        pgPoolSize = 0,
+        bcryptRounds = utils.BCRYPT_ROUNDS,
+        pwWorkerCount = 2,
+        pwQueueLimit = 32,
+        loginThrottleRate = 10,
+        loginThrottleBurst = 20,
+        trustedProxyCount = 0,
+        mediaDir = None,
+        mediaMaxBytes = 20 * 1024 * 1024,
+        mediaWorkerCount = 2,
+        jobWorkerCount = 2,
+        cacheMaxAge = 0,
+        cacheStaleSecs = 600,
+        purgeHook = None,
     ):
     ########################################################
     # Prelims: #############################################
@@ -231,6 +361,7 @@ def buildApp (
     if devMode:
         cookieSecret = cookieSecret or "dev_cookie_secret";
         antiCsrfSecret = antiCsrfSecret or "dev_xCsrf_secret";
+        cacheMaxAge = 0;
     else:
         cookieSecret = cookieSecret or utils.genId(3);
         antiCsrfSecret = antiCsrfSecret or utils.genId(3);
@@ -240,6 +371,7 @@ def buildApp (
         "setup.html", "login.html", "reset.html",
         "page-lister.html", "page-editor.html",
         "user-lister.html", "user-editor.html",
+        "revision-lister.html", "media-lister.html",
     ]);
     validateThemeDir(blogThemeDir, [
         "home.html", "page.html", "404.html",
@@ -247,31 +379,123 @@ def buildApp (
     if not re.match(r"^_login\w*$", loginSlug):
         raise ValueError(r"Invalid `loginSlug`, doesn't match: r'_login\w*'");
     loginPath = "/" + loginSlug;
+    if mediaDir:
+        mediaDir = os.path.abspath(mediaDir);
+        os.makedirs(mediaDir, exist_ok=True);
+        markup.mediaDirRef.path = mediaDir;     # For `srcset`s.
     
     # Build app, db-connector:
     app = vilo.buildApp();
-    dbful = pogodb.makeConnector(pgUrl, verbose=False);
+    if pgPoolSize:
+        rawDbful = dbPool.makePooledConnector(pgUrl, pgPoolSize);
+    else:
+        rawDbful = pogodb.makeConnector(pgUrl, verbose=False);
+    
+    # DB setup (beyond pogotbl), run once per process:
+    dbSetupRef = dotsi.fy({"done": False});
+    dbSetupLock = threading.Lock();
+
+    @rawDbful
+    def runDbSetup (db):
+        loginThrottle.ensureTable(db);
+        revisionModel.ensureTable(db);
+        jobModel.ensureTable(db);
+
+    def ensureDbSetup ():
+        "Runs DB setup in its own transaction, flagging it done post-commit.";
+        if dbSetupRef.done: return;
+        with dbSetupLock:
+            if dbSetupRef.done: return;
+            runDbSetup();   # Commits, or raises (& is retried next time).
+            dbSetupRef.done = True;
+    
+    def dbful (fn):
+        @rawDbful
+        def inner (*a, db, **ka):
+            return fn(db=db, *a, **ka);
+        def wrapper (*a, **ka):
+            ensureDbSetup();    # Not within `inner`'s txn, which may roll back.
+            if jobRunner: jobRunner.ensureStarted();
+            # ^ After setup, so that the job table surely exists.
+            return inner(*a, **ka);
+        return functools.update_wrapper(wrapper, fn);
+    dbful.__dict__.update(rawDbful.__dict__); # Exposes .closeAll(), etc.
+    app.dbful = dbful;
     if devMode: app.setDebug(True);
     
+    # Background jobs, run by worker threads (started lazily, per process):
+    jobHandlerMap = {};
+    jobRunner = None;
+    if jobWorkerCount:
+        jobRunner = jobModel.mkJobRunner(
+            dbful, blogId, jobHandlerMap, jobWorkerCount,
+        );
+    app.jobRunner = jobRunner;
+
+    def jobHandler (kind):
+        "Decorator for registering a handler for jobs of type `kind`.";
+        def decorator (fn):
+            jobHandlerMap[kind] = fn;
+            return fn;
+        return decorator;
+
+    def enqueueJob (db, kind, payload=None, dedupKey=None, delaySecs=0,
+            upsert=False,
+        ):
+        "Enqueues a job, to run after commit. W/o job workers, runs inline.";
+        assert kind in jobHandlerMap;
+        if not jobRunner and not delaySecs:
+            return jobHandlerMap[kind](db, dotsi.fy(payload or {}));
+        # ^ Delayed jobs can't run inline. W/o workers, see `runDueJobs`.
+        jobModel.enqueue(db, blogId, kind, payload, dedupKey, delaySecs,
+            upsert,
+        );
+
+    def runDueJobs ():
+        "Runs due jobs in the calling thread (e.g. via cron). Returns count.";
+        runner = jobRunner or jobModel.mkJobRunner(
+            dbful, blogId, jobHandlerMap, 0,
+        );
+        count = 0;
+        while runner.workOnce():
+            count += 1;
+        return count;
+    app.runDueJobs = runDueJobs;
+    
+    # Password hasher, with bounded bcrypt worker pool:
+    pwHasher = utils.mkPwHasher(bcryptRounds, pwWorkerCount, pwQueueLimit);
+    app.pwHasher = pwHasher;
+    
     # Renderers:
     adminTpl = mkRenderTpl(_adminThemeDir, {
         "blogTitle": blogTitle,
         "blogDescription": blogDescription,
         "footerLine": footerLine,
-    });
+    }, cacheTpls=not devMode);
     blogTpl = mkRenderTpl(blogThemeDir, {
         "blogTitle": blogTitle,
         "blogDescription": blogDescription,
         "footerLine": footerLine,    
-    });
+        "renderMarkdown": markup.renderMarkdown,
+        "mediaSrcset": markup.mediaSrcset,
+    }, cacheTpls=not devMode);
 
     # Install plugins:
+    app.install(mkPlugin_cacheControl(cacheMaxAge, cacheStaleSecs));
     if remoteHttpsOnly:
         app.install(plugin_enforceRemoteHttps);
     if remoteNetlocList:
         app.install(mkPlugin_enforceRemoteNetloc(remoteNetlocList));
     if disableRemoteLogin:
         app.install(mkPlugin_disableRemoteLogin(blogTpl));
+    throttle = None;
+    if loginThrottleRate:
+        throttle = loginThrottle.mkLoginThrottle(
+            loginThrottleRate, loginThrottleBurst,
+        );
+        app.install(mkPlugin_throttleLogin(
+            loginPath, throttle, dbful, trustedProxyCount,
+        ));
 
     ########################################################
     # Authentication Helpers: ##############################
@@ -309,6 +533,23 @@ def buildApp (
             raise errLine("Access deactivated.");
         return user;
 
+    def pwBusy ():
+        return vilo.error(oneLine("""Server busy.
+            Please wait a few seconds and then try again.
+        """), 503);
+
+    def hashPw (password):
+        try:
+            return pwHasher.hashPw(password);
+        except utils.PwQueueFullError:
+            raise pwBusy();
+
+    def checkPw (password, hpw):
+        try:
+            return pwHasher.checkPw(password, hpw);
+        except utils.PwQueueFullError:
+            raise pwBusy();
+
     def authful (fn):
         @dbful
         def wrapper(req, res, db, *a, **ka):
@@ -326,6 +567,86 @@ def buildApp (
             Only admins and page-authors can edit/delete pages.
         """);
     
+    ########################################################
+    # Page-Write Hook: #####################################
+    ########################################################
+
+    # Preview-only cache, keyed by (template, isoDate, pageId). The TTL
+    # bounds staleness w.r.t writes made via other processes.
+    previewNeighbourCache = utils.mkLruCache(256, ttl=30);
+
+    def afterPageWrite (db, page=None):
+        "Called after each page insert/replace/delete, or bulk delete.";
+        # Page stats (like tag counts) are updated by the write itself,
+        # so the purge job, run after commit, never precedes them.
+        previewNeighbourCache.reset();
+        if purgeHook and cacheMaxAge:   # Else, nothing's cached.
+            enqueueJob(db, "purgeCache", {
+                "keyList": getPurgeKeyList(db, page),
+            });
+
+    getPublishJobKey = lambda pageId: "publishPage:" + pageId;
+
+    def schedulePublish (db, page):
+        "Forces pages scheduled for later to be drafts, & (re)schedules them.";
+        # Call before writing `page`. Thus, public queries (& caches)
+        # only ever see `isDraft`, and never need to check the time.
+        dedupKey = getPublishJobKey(page._id);
+        if not page.meta.get("publishAt"):
+            return jobModel.dequeue(db, blogId, dedupKey);  # Unscheduled, if need be.
+        delaySecs = pageModel.applyPublishAt(page);
+        if delaySecs:
+            enqueueJob(db, "publishPage", {
+                "pageId": page._id, "publishAt": page.meta.publishAt,
+            }, dedupKey=dedupKey, delaySecs=delaySecs, upsert=True);
+        # otherwise, already due. If pending, the job will publish it.
+
+    @jobHandler("publishPage")
+    def job_publishPage (db, payload):
+        page = pageModel.getPage(db, payload.pageId, blogId);
+        if not (page and page.meta.isDraft and
+            page.meta.get("publishAt") == payload.publishAt
+        ):
+            return;     # Deleted, rescheduled or published meanwhile.
+        page.meta.isDraft = False;
+        pageModel.replacePage(db, page, blogId);
+        revisionModel.recordRevision(db, page, page.authorId, blogId);
+        afterPageWrite(db, page);
+
+    # Surrogate keys, for purging cached responses by tag:
+    blogKey = "blog-" + (blogId or "default");      # All public responses.
+    listKey = "pages-" + (blogId or "default");     # Page listings.
+    pageKey = lambda pageId: "page-" + pageId;
+
+    def setSurrogateKeys (res, keyList):
+        res.setHeader("Surrogate-Key", " ".join([blogKey] + keyList));
+
+    def getPurgeKeyList (db, page=None):
+        "Returns keys to purge after writing `page`. W/o `page`, purges all.";
+        if not page:
+            return [blogKey];
+        # Pages carry their neighbours' keys too, as they link to them.
+        # Old neighbours are thus purged via `page`'s key, and new ones:
+        neighbourList = pageModel.getNextAndPrevPages_exclDrafts(
+            db, page, blogId,
+        );
+        return [listKey, pageKey(page._id)] + [
+            pageKey(p._id) for p in neighbourList if p
+        ];
+
+    @jobHandler("purgeCache")
+    def job_purgeCache (db, payload):
+        if not purgeHook:
+            raise ValueError("Can't purge; no `purgeHook` in this process.");
+            # ^ Enqueued by a process of this blog w/ a hook. Retried,
+            #   perhaps by such a process, else marked 'failed'.
+        try:
+            purgeHook(payload.keyList);
+        except Exception:
+            if jobRunner: raise;    # Retried later, with backoff.
+            # otherwise, inline; so don't fail the page-write:
+            print("\n" + traceback.format_exc() + "\n");
+
     ########################################################
     # Setup: ###############################################
     ########################################################
@@ -347,7 +668,7 @@ def buildApp (
         # otherwise ...
         f = req.fdata;
         user = userModel.buildUser(
-            f.name, f.email, f.password, "admin", blogId,
+            f.name, f.email, f.password, "admin", blogId, hashPw,
         );
         userModel.insertUser(db, user, blogId);
         return startLoginSession(user, res);
@@ -365,6 +686,8 @@ def buildApp (
     def get_reset (req, res, user, db):
         assert user.role == "admin";
         pageModel.deleteAllPages(db, blogId);
+        revisionModel.deleteAllRevisions(db, blogId);
+        afterPageWrite(db);
         userModel.deleteAllUsers(db, blogId);
         return res.redirect("/_setup");
 
@@ -373,6 +696,8 @@ def buildApp (
     def get_reset (req, res, user, db):
         assert user.role == "admin";
         pageModel.deleteAllPages(db, blogId);
+        revisionModel.deleteAllRevisions(db, blogId);
+        afterPageWrite(db);
         return res.redirect("/_pages");
 
     ########################################################
@@ -388,10 +713,13 @@ def buildApp (
     def post_login (req, res, db):
         f = req.fdata;
         user = userModel.getUserByEmail(db, f.email, blogId);
-        if not (user and utils.checkPw(f.password, user.hpw)):
+        if not (user and checkPw(f.password, user.hpw)):
             raise errLine("Invalid email and/or password.");
         if user.role == "deactivated":
             raise errLine("Access deactivated.");
+        if pwHasher.needsRehash(user.hpw):
+            user.update({"hpw": hashPw(f.password)});
+            userModel.replaceUser(db, user, blogId);
         return startLoginSession(user, res);
 
     @app.route("GET", "/_logout")
@@ -402,12 +730,53 @@ def buildApp (
     # Page Management: #####################################
     ########################################################
     
+    PAGE_LISTER_SORT_MAP = {
+        # sortParam: [sortBy, ascending]
+        "newest": ["isoDate", False],
+        "oldest": ["isoDate", True],
+        "title": ["title", True],
+        "title-desc": ["title", False],
+    };
+
     @app.route("GET", "/_pages")
     @authful
     def get_pages (req, res, db, user):
-        pageList = pageModel.getAllPages_inclDrafts(db, blogId);
+        q = req.qdata;
+        filters = {
+            "status": q.get("status") or "",
+            "author": q.get("author") or "",
+            "template": q.get("template") or "",
+            "titlePrefix": q.get("titlePrefix") or "",
+            "sort": q.get("sort") or "newest",
+        };
+        if filters["sort"] not in PAGE_LISTER_SORT_MAP:
+            raise errLine("Invalid sort order.");
+        sortBy, ascending = PAGE_LISTER_SORT_MAP[filters["sort"]];
+        try:
+            after = json.loads(q.get("after") or "null");
+            assert after is None or (
+                type(after) is list and len(after) == 2 and
+                all(type(x) is str for x in after)
+            );
+        except (ValueError, AssertionError):
+            raise errLine("Invalid pagination cursor.");
+        pageList, nextAfter = pageModel.getAdminPageStubs(db, blogId,
+            status=filters["status"], authorId=filters["author"],
+            template=filters["template"], titlePrefix=filters["titlePrefix"],
+            sortBy=sortBy, ascending=ascending, after=after,
+        );
+        nextUrl = None;
+        if nextAfter:
+            nextUrl = "/_pages?" + urllib.parse.urlencode(
+                dict(filters, after=json.dumps(nextAfter)),
+            );
         return adminTpl("page-lister.html", data={
             "pageList": pageList,
+            "filters": filters,
+            "isFirstPage": after is None,
+            "nextUrl": nextUrl,
+            "pageStats": pageModel.getPageStats(db, blogId),
+            "userList": userModel.getAllUsers(db, blogId),
             "title": "ViloLog ~ All Pages",
         });
 
@@ -435,7 +804,10 @@ def buildApp (
             meta, req.fdata.body, user, blogId
         );
         #pprint.pprint(page);
+        schedulePublish(db, page);
         pageModel.insertPage(db, page, blogId);
+        revisionModel.recordRevision(db, page, user._id, blogId);
+        afterPageWrite(db, page);
         return oneLine(vilo.escfmt("""Done!
             <a href='/%s'>View page</a>,
             <a href='/_editPage/%s'>edit it</a>,
@@ -471,7 +843,10 @@ def buildApp (
             if sameSlugPage:
                 raise errLine("Slug already taken. Try another?");
         page.update({"meta": meta, "body": req.fdata.body});
+        schedulePublish(db, page);
         pageModel.replacePage(db, page, blogId);
+        revisionModel.recordRevision(db, page, user._id, blogId);
+        afterPageWrite(db, page);
         return oneLine(vilo.escfmt("""Done!
             <a href='/%s'>View page,</a>
             <a href=''>re-edit it</a>,
@@ -495,16 +870,26 @@ def buildApp (
                 pageModel.buildPage(meta, f.body, user, blogId)
             );
             currentPage.update({"meta": meta, "body": f.body});
+            pageModel.refreshDerived(currentPage);
             if f.saveYesNo == "Yes":    # str, not bool.
+                schedulePublish(db, currentPage);
                 pageModel.replacePage(db, currentPage, blogId);
+                revisionModel.recordRevision(db, currentPage, user._id, blogId);
+                afterPageWrite(db, currentPage);
                 if not currentPage.meta.isDraft:
                     return res.redirect("/" + currentPage.meta.slug);
         else:
             currentPage = pageModel.getPage(db, pageId, blogId);
         # Eitherway ...
         assert currentPage;
-        nextPage, prevPage = pageModel.getNextAndPrevPages_inclDrafts(
-            db, currentPage, blogId,
+        cacheKey = (
+            currentPage.meta.template, currentPage.meta.isoDate, currentPage._id,
+        );
+        nextPage, prevPage = (
+            previewNeighbourCache.lookup(cacheKey) or
+            previewNeighbourCache.store(cacheKey,
+                pageModel.getNextAndPrevPages_inclDrafts(db, currentPage, blogId),
+            )
         );
         return blogTpl(currentPage.meta.template, data={
                 "currentPage": currentPage,
@@ -525,8 +910,80 @@ def buildApp (
         if not page: raise errLine("No such page.");
         assert validatePageEditDelRole(user, page);
         pageModel.deletePage(db, page, blogId);
+        revisionModel.deleteRevisions(db, page._id);
+        jobModel.dequeue(db, blogId, getPublishJobKey(page._id));
+        afterPageWrite(db, page);
         return res.redirect("/_pages");
 
+    ########################################################
+    # Page Revisions: ######################################
+    ########################################################
+
+    def getRevisionOrErr (db, pageId, seq):
+        if not re.match(r"^\d+$", seq):
+            raise errLine("No such revision.");
+        revision = revisionModel.getRevision(db, pageId, int(seq));
+        if not revision:
+            raise errLine("No such revision.");
+        return revision;
+
+    def diffRevisions (oldRevision, newRevision):
+        "Returns unified diff (as list of lines) of meta & body.";
+        jsonLines = lambda rev: json.dumps(
+            rev.meta, indent=4, sort_keys=True,
+        ).splitlines(True);
+        oldLabel = "rev%s" % oldRevision.seq if oldRevision else "(none)";
+        newLabel = "rev%s" % newRevision.seq;
+        return list(difflib.unified_diff(
+            jsonLines(oldRevision) if oldRevision else [],
+            jsonLines(newRevision), oldLabel + "/meta", newLabel + "/meta",
+        )) + list(difflib.unified_diff(
+            oldRevision.body.splitlines(True) if oldRevision else [],
+            newRevision.body.splitlines(True),
+            oldLabel + "/body", newLabel + "/body",
+        ));
+
+    @app.route("GET", "/_revisions/*")
+    @authful
+    def get_revisions (req, res, db, user):
+        pageId = req.wildcards[0];
+        page = pageModel.getPage(db, pageId, blogId);
+        if not page: raise errLine("No such page.");
+        diffLines = None;
+        if req.qdata.get("diff"):
+            newRevision = getRevisionOrErr(db, pageId, req.qdata["diff"]);
+            oldRevision = newRevision.seq and revisionModel.getRevision(
+                db, pageId, newRevision.seq - 1,
+            );
+            diffLines = diffRevisions(oldRevision, newRevision);
+        return adminTpl("revision-lister.html", data={
+            "page": page,
+            "revisionList": revisionModel.getRevisionSummaryList(db, pageId),
+            "diffSeq": req.qdata.get("diff"),
+            "diffLines": diffLines,
+            "userList": userModel.getAllUsers(db, blogId),
+            "title": "ViloLog ~ Page History",
+        });
+
+    @app.route("POST", "/_restoreRevision/*")
+    @authful
+    def post_restoreRevision (req, res, db, user):
+        pageId = req.wildcards[0];
+        page = pageModel.getPage(db, pageId, blogId);
+        if not page: raise errLine("No such page.");
+        assert validatePageEditDelRole(user, page);
+        revision = getRevisionOrErr(db, pageId, req.fdata.get("seq") or "");
+        if revision.meta.slug != page.meta.slug:
+            sameSlugPage = pageModel.getPageBySlug(db, revision.meta.slug, blogId);
+            if sameSlugPage:
+                raise errLine("Can't restore, slug now taken by another page.");
+        page.update({"meta": revision.meta, "body": revision.body});
+        schedulePublish(db, page);
+        pageModel.replacePage(db, page, blogId);
+        revisionModel.recordRevision(db, page, user._id, blogId);
+        afterPageWrite(db, page);
+        return res.redirect("/_revisions/" + pageId);
+
     ########################################################
     # User Management: #####################################
     ########################################################
@@ -566,7 +1023,7 @@ def buildApp (
             raise errLine("Error: Email address already registered.");
         # otherwise ...
         newUser = userModel.buildUser(
-            f.name, f.email, f.password, f.role, blogId,
+            f.name, f.email, f.password, f.role, blogId, hashPw,
         );
         userModel.insertUser(db, newUser, blogId);
         return res.redirect("/_users");
@@ -606,22 +1063,244 @@ def buildApp (
         thatUser.update({"name": f.name, "role": f.role});
         # TODO: _Consider_ allowing email update?
         if f.password:
-            thatUser.update({"hpw": utils.hashPw(f.password)});
+            thatUser.update({"hpw": hashPw(f.password)});
         userModel.replaceUser(db, thatUser, blogId);
         return res.redirect("/_users");
 
     ########################################################
-    # Serving Content: #####################################
+    # Monitoring: ##########################################
     ########################################################
 
-    @app.route("GET", "/")
+    @app.route("GET", "/_metrics")
+    @authful
+    def get_metrics (req, res, db, user):
+        if user.role != "admin":
+            raise errLine("Access denied. Only admins can view metrics.");
+        # otherwise ...
+        return {
+            "pwHasher": pwHasher.stats,     # Per process.
+            "markdownCache": markup.htmlCache.stats,
+            "loginThrottle": throttle and dict(throttle.stats, **{
+                "emptyBuckets": loginThrottle.countEmptyBuckets(db),
+            }),
+            "jobs": dict(jobModel.getQueueStats(db, blogId), **{
+                "processed": jobRunner and jobRunner.stats, # Per process.
+            }),
+        };
+
+    ########################################################
+    # Media: ###############################################
+    ########################################################
+
+    # Vilo reads each request body fully into memory, so uploads
+    # are intercepted *before* Vilo (see `mediaUploadWsgi`) and are
+    # streamed to disk. The request is then passed on, sans body,
+    # to the `uploadPath` route, for the usual auth & CSRF checks.
+    uploadPath = "/_uploadMedia";
+    uploadEnvironKey = "vilolog.upload";    # Not settable by clients.
+    variantExecutor = mediaDir and concurrent.futures.ThreadPoolExecutor(
+        mediaWorkerCount, thread_name_prefix="vilolog-media",
+    );
+    app.variantExecutor = variantExecutor;
+
     @dbful
-    def get_homepage (req, res, db):
-        pageList = pageModel.getAllPages_exclDrafts(db, blogId);
+    def markMediaReady (sha, dims, db):
+        width, height, variantWidthList = dims;
+        for media in mediaModel.getMediaListBySha(db, sha):
+            media.update({
+                "width": width, "height": height,
+                "variantWidths": variantWidthList, "status": "ready",
+            });
+            mediaModel.replaceMedia(db, media, media.blogId);
+
+    def processMedia (sha, ext):
+        "Generates variants (without holding a DB conn), then marks ready.";
+        try:
+            dims = mediaModel.generateVariants(mediaDir, sha, ext);
+            markMediaReady(sha, dims);
+            markup.srcsetCache.reset();     # Cached HTML may lack the
+            markup.htmlCache.reset();       # new variants in `srcset`s.
+        except Exception:
+            print("\n" + traceback.format_exc() + "\n");
+
+    @dbful
+    def checkUploader (userId, db):
+        "Returns True if user `userId` exists, and isn't deactivated.";
+        user = userModel.getUser(db, userId, blogId);
+        return bool(user and user.role != "deactivated");
+
+    def receiveUpload (req, environ):
+        "Streams upload to disk, if allowed. Returns dict with `sha` or `error`.";
+        userId = req.getCookie("userId", cookieSecret);
+        xCsrfToken = req.getHeader("X-CSRF-Token") or "";
+        if not userId or userId != vilo.signUnwrap(xCsrfToken, antiCsrfSecret):
+            return {};  # Route's auth check will respond.
+        if not checkUploader(userId):
+            return {};  # Deleted/deactivated since login. Ditto.
+        ext = mediaModel.MIME_EXT_MAP.get(environ.get("CONTENT_TYPE"));
+        if not ext:
+            return {"error": "Unsupported file type.", "code": "415 Unsupported Media Type"};
+        size = int(environ.get("CONTENT_LENGTH") or 0);
+        if size <= 0:
+            return {"error": "Content-Length required.", "code": "411 Length Required"};
+        if size > mediaMaxBytes:
+            return {"error": "File too large.", "code": 413};
+        try:
+            sha = mediaModel.storeStream(
+                mediaDir, environ["wsgi.input"], size, ext,
+            );
+        except ValueError as e:
+            return {"error": str(e), "code": 400};
+        filename = req.qdata.get("filename") or "";
+        return {"sha": sha, "ext": ext, "size": size, "filename": filename};
+
+    def mediaUploadWsgi (environ, start_response):
+        "WSGI callable, streams uploads to disk before invoking Vilo.";
+        isUpload = (
+            environ.get("REQUEST_METHOD") == "POST" and
+            environ.get("PATH_INFO") == uploadPath
+        );
+        if not (mediaDir and isUpload):
+            return viloWsgi(environ, start_response);
+        # otherwise ...
+        bodylessEnviron = dict(environ, **{
+            "wsgi.input": io.BytesIO(b""),
+            "CONTENT_TYPE": "", "CONTENT_LENGTH": "0",
+        });
+        req = vilo.buildRequest(bodylessEnviron);
+        upload = receiveUpload(req, environ);
+        formBytes = utils._b(urllib.parse.urlencode({
+            "xCsrfToken": req.getHeader("X-CSRF-Token") or "",
+        }));
+        bodylessEnviron.update({
+            uploadEnvironKey: upload,
+            "wsgi.input": io.BytesIO(formBytes),
+            "CONTENT_TYPE": "application/x-www-form-urlencoded",
+            "CONTENT_LENGTH": str(len(formBytes)),
+        });
+        chunkList = viloWsgi(bodylessEnviron, start_response);
+        if upload.get("needsVariants"):     # Set by route, post-commit.
+            variantExecutor.submit(processMedia, upload["sha"], upload["ext"]);
+        return chunkList;
+    viloWsgi = app.wsgi;
+    app.wsgi = mediaUploadWsgi;
+
+    @app.route("POST", uploadPath)
+    @authful
+    def post_uploadMedia (req, res, db, user):
+        upload = req.getEnviron().get(uploadEnvironKey);
+        if upload is None:
+            raise errLine("Media uploads are disabled. See `mediaDir`.");
+        if upload.get("error"):
+            raise vilo.error(oneLine(upload["error"]), upload["code"]);
+        # otherwise ...
+        media = mediaModel.getMediaBySha(db, upload["sha"], blogId);
+        if not media:
+            media = mediaModel.buildMedia(
+                upload["sha"], upload["ext"], upload["size"],
+                upload["filename"], user, blogId,
+            );
+            mediaModel.insertMedia(db, media, blogId);
+        if media.status != "ready":
+            upload["needsVariants"] = True;
+        url = "/_media/%s.%s" % (media.sha, media.ext);
+        altText = os.path.splitext(media.filename)[0] or "image";
+        return {
+            "mediaId": media._id,
+            "url": url,
+            "markdown": "![%s](%s)" % (altText, url),
+        };
+
+    @app.route("GET", "/_media")
+    @authful
+    def get_mediaLister (req, res, db, user):
+        return adminTpl("media-lister.html", data={
+            "mediaList": mediaModel.getRecentMediaList(db, blogId),
+            "mediaEnabled": bool(mediaDir),
+            "mediaMaxBytes": mediaMaxBytes,
+            "mimeTypeList": list(mediaModel.MIME_EXT_MAP.keys()),
+            "title": "ViloLog ~ Media",
+        });
+
+    @app.route("GET", "/_media/*")
+    def get_mediaFile (req, res):
+        name = req.wildcards[0];
+        match = mediaDir and re.match(mediaModel.MEDIA_NAME_RE, name);
+        if not match:
+            raise vilo.error(blogTpl("404.html", data={"req": req, "res": res}));
+        # otherwise ...
+        path = mediaModel.getMediaPath(mediaDir, name);
+        cacheControl = "public, max-age=31536000, immutable";
+        if match.group(2) and not os.path.isfile(path):
+            # Variant not (yet) generated, serve original briefly:
+            path = mediaModel.getMediaPath(mediaDir,
+                "%s.%s" % (match.group(1), match.group(3)),
+            );
+            cacheControl = "public, max-age=60";
+        content = res.staticFile(path);
+        res.setHeader("Cache-Control", cacheControl);
+        res.setHeader("X-Content-Type-Options", "nosniff");
+        return content;
+
+    ########################################################
+    # Serving Content: #####################################
+    ########################################################
+
+    def parseBefore (req):
+        "Parses keyset-pagination param `before`, like '<isoDate>.<_id>'.";
+        before = req.qdata.get("before") or "";
+        if not re.match(r"^\d\d\d\d-\d\d-\d\d\.\w+$", before):
+            return None;
+        return before.split(".", 1);
+
+    def renderPageList (req, res, db, stubList, nextBefore, listTitle=None):
+        "Renders home.html w/ `stubList`, and a link to older pages.";
+        olderUrl = None;
+        if nextBefore:
+            olderUrl = req.splitUrl.path + "?before=" + ".".join(nextBefore);
+        setSurrogateKeys(res, [listKey]);
         return blogTpl("home.html", data={
-            "pageList": pageList,
+            "pageList": stubList,
+            "listTitle": listTitle,
+            "olderUrl": olderUrl,
+            "tagCounts": pageModel.getPageStats(db, blogId).tagCounts,
             "req": req, "res": res,
         });
+
+    @app.route("GET", "/")
+    @dbful
+    def get_homepage (req, res, db):
+        stubList, nextBefore = pageModel.getPageStubs(
+            db, blogId, after=parseBefore(req), asRecords=True,
+        );
+        return renderPageList(req, res, db, stubList, nextBefore);
+
+    @app.route("GET", "/tag/*")
+    @dbful
+    def get_tagArchive (req, res, db):
+        tag = req.wildcards[0];
+        if not re.match(pageModel.TAG_RE, tag):
+            raise vilo.error(blogTpl("404.html", data={
+                "req": req, "res": res,
+            }));
+        stubList, nextBefore = pageModel.getPageStubsByTag(
+            db, tag, blogId, before=parseBefore(req), asRecords=True,
+        );
+        return renderPageList(req, res, db, stubList, nextBefore,
+            listTitle="Tagged: " + tag,
+        );
+
+    @app.route("GET", r"^/archive/(\d\d\d\d)(?:/(\d\d))?/?$")
+    @dbful
+    def get_dateArchive (req, res, db):
+        year, month = req.matched.groups();
+        datePrefix = year + ("-" + month if month else "");
+        stubList, nextBefore = pageModel.getPageStubsByDatePrefix(
+            db, datePrefix, blogId, before=parseBefore(req), asRecords=True,
+        );
+        return renderPageList(req, res, db, stubList, nextBefore,
+            listTitle="Archive: " + datePrefix,
+        );
     
     @app.route("GET", "/_latest")   # Admin-shortcut to latest page.
     @dbful
@@ -640,13 +1319,14 @@ def buildApp (
     @app.route("GET", "/sitemap.txt")
     @dbful
     def get_sitemapTxt (req, res, db):
-        pageList = pageModel.getAllPages_exclDrafts(db, blogId);
+        stubIter = pageModel.iterPages(db, {"meta": {"isDraft": False}},
+            blogId, "ORDER BY doc->'meta'->>'isoDate' DESC", stubsOnly=True,
+        );
         schHost = req.splitUrl.scheme + "://" + req.splitUrl.netloc;
         # ^ Scheme w/ netloc. (Netloc includes port.)
-        pageUrlList = utils.mapli(pageList,
-            lambda p: schHost + "/" + p.meta.slug
-        );
+        pageUrlList = [schHost + "/" + p.meta.slug for p in stubIter];
         res.contentType = "text/plain";
+        setSurrogateKeys(res, [listKey]);
         rootUrl = schHost + "/";
         return "\n".join([rootUrl] + pageUrlList);
     
@@ -662,6 +1342,9 @@ def buildApp (
         nextPage, prevPage = pageModel.getNextAndPrevPages_exclDrafts(
             db, currentPage, blogId,
         );
+        setSurrogateKeys(res, [
+            pageKey(p._id) for p in [currentPage, nextPage, prevPage] if p
+        ]);
         return blogTpl(currentPage.meta.template, data={
                 "currentPage": currentPage,
                 "title": currentPage.meta.title + " // " + blogTitle,
@@ -692,15 +1375,116 @@ def buildApp (
     @app.frameworkError("route_not_found")
     @app.frameworkError("file_not_found")
     def route_not_found (req, res, err):
+        res.setHeader("Cache-Control", PRIVATE_CACHE_CONTROL);
+        # ^ As plugins (incl. cache-control) aren't applied here.
         path = req.getPathInfo();
         if redirectMap and path in redirectMap:
             return res.redirect(redirectMap[path]);
         # otherwise ...
         return blogTpl("404.html", data={"req": req, "res": res});
 
+    ########################################################
+    # Warm-Up & Readiness: #################################
+    ########################################################
+
+    readyRef = dotsi.fy({"pid": None, "warming": False});
+    # ^ Readiness is per process, as pooled conns don't survive forks.
+    readyLock = threading.Lock();
+
+    @dbful
+    def preloadPages (db):
+        "Preloads page stubs & stats, and renders the latest page's body.";
+        stubList, _ = pageModel.getPageStubs(db, blogId, asRecords=True);
+        pageModel.getPageStats(db, blogId);
+        latestPage = pageModel.getLatestPage_exclDrafts(db, blogId);
+        if latestPage:
+            markup.renderMarkdown(latestPage.body);
+        return len(stubList);
+
+    def warmUp ():
+        "Primes DB conns, runs DB setup, compiles templates & preloads pages.";
+        startTime = time.time();
+        if hasattr(rawDbful, "prime"):
+            rawDbful.prime();
+        tplCount = adminTpl.precompile() + blogTpl.precompile();
+        stubCount = preloadPages();     # Also runs ensureDbSetup()
+        readyRef.pid = os.getpid();
+        return {
+            "templates": tplCount, "stubs": stubCount,
+            "secs": round(time.time() - startTime, 3),
+        };
+    app.warmUp = warmUp;
+    app.isReady = lambda: readyRef.pid == os.getpid();
+
+    def startWarmUp ():
+        "Starts warm-up in a background thread, unless already started.";
+        with readyLock:
+            if app.isReady() or readyRef.warming:
+                return;
+            readyRef.warming = True;
+        def target ():
+            try:
+                warmUp();
+            except Exception:
+                print("\n" + traceback.format_exc() + "\n");
+            finally:
+                readyRef.warming = False;
+        threading.Thread(target=target, name="vilolog-warmup").start();
+
+    def readinessWsgi (environ, start_response):
+        "WSGI callable, answers `/_ready` before Vilo (& plugins) get involved.";
+        if environ.get("PATH_INFO") != "/_ready":
+            return innerWsgi(environ, start_response);
+        # otherwise ...
+        if not app.isReady():
+            startWarmUp();  # Thus, the 1st probe triggers warm-up.
+        isReady = app.isReady();
+        body = utils._b(json.dumps({"ready": isReady}));
+        start_response("200 OK" if isReady else "503 Service Unavailable", [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+            ("Cache-Control", "no-store"),
+        ]);
+        return [body];
+    innerWsgi = app.wsgi;
+    app.wsgi = readinessWsgi;
+
     ########################################################
     # Return built `app`: ##################################
     ########################################################
     return app;
 
+############################################################
+# Maintenance: #############################################
+############################################################
+
+def refreshPageStats (pgUrl, blogId=""):
+    "Recomputes page stats (counts) from scratch, e.g. to repair them.";
+    with pogodb.connect(pgUrl) as db:
+        return pageModel.refreshPageStats(db, blogId);
+
+def backfillDerived (pgUrl, blogId=""):
+    "Computes derived fields (excerpt, TOC, etc.) for existing pages.";
+    with pogodb.connect(pgUrl) as db:
+        return pageModel.backfillDerived(db, blogId);
+
+def createIndexes (pgUrl, verbose=True):
+    "Builds missing page indexes, concurrently. Safe to run alongside the app.";
+    return migrations.createIndexes(pgUrl, pageModel.PAGE_INDEX_LIST, verbose);
+
+def migrateDocs (pgUrl, batchSize=100, pauseSecs=0.1, verbose=True):
+    "Builds missing indexes, then upgrades old-version pages and users.";
+    # Safe to run alongside the app.
+    createIndexes(pgUrl, verbose);
+    return {
+        "page": migrations.migrateDocs(pgUrl, "page",
+            pageModel.PAGE_UPGRADER_MAP, pageModel.PAGE_VERSION,
+            batchSize, pauseSecs, verbose,
+        ),
+        "user": migrations.migrateDocs(pgUrl, "user",
+            userModel.USER_UPGRADER_MAP, userModel.USER_VERSION,
+            batchSize, pauseSecs, verbose,
+        ),
+    };
+
 # End ######################################################